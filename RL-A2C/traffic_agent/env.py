@@ -6,15 +6,8 @@ from typing import Dict, Tuple, Any
 import gymnasium as gym
 from gymnasium import spaces
 import numpy as np
-import paho.mqtt.client as mqtt
 
-
-def make_mqtt_client(client_id: str | None = None) -> mqtt.Client:
-    """
-    Tworzy klienta MQTT kompatybilnego z paho-mqtt 1.x.
-    Jeśli kiedyś podmienisz na 2.x, tutaj można dodać callback_api_version.
-    """
-    return mqtt.Client(client_id=client_id)
+from mqtt_runtime import Message, get_runtime
 
 
 class TrafficLightEnv(gym.Env):
@@ -49,6 +42,7 @@ class TrafficLightEnv(gym.Env):
         max_duration_ms: int = 300000,
         obs_timeout: float = 3.0,
         client_id: str | None = "rl_traffic_env",
+        connect_timeout: float = 40.0,
     ):
         super().__init__()
         self.broker_ip = broker_ip
@@ -95,37 +89,20 @@ class TrafficLightEnv(gym.Env):
         self._step = 0
         self._episode_reward = 0.0
 
-        # MQTT setup
-        self._client = make_mqtt_client(client_id)
-        self._client.on_message = self._on_message
-        self._client.on_connect = self._on_connect
-
-        max_tries = 20
-        for attempt in range(max_tries):
-            try:
-                print(f"[MQTT] Connecting to broker {self.broker_ip}:{self.broker_port} (attempt {attempt+1}/{max_tries})")
-                self._client.connect(self.broker_ip, self.broker_port)
-                print("[MQTT] Connected to broker")
-                break
-            except Exception as e:
-                print(f"[MQTT] Connection failed (attempt {attempt+1}/{max_tries}): {e}")
-                time.sleep(2)
-        else:
-            raise RuntimeError("Could not connect to MQTT broker after multiple attempts")
-
-        self._client.loop_start()
-        self._client.subscribe(self.status_topic)
-
-    # MQTT callbacks
-
-    def _on_connect(self, client: mqtt.Client, userdata, flags, rc):
-        if rc == 0:
-            print(f"[MQTT] on_connect: success, rc={rc}")
-            client.subscribe(self.status_topic)
-        else:
-            print(f"[MQTT] on_connect: error, rc={rc}")
-
-    def _on_message(self, client: mqtt.Client, userdata, msg):
+        # MQTT setup: wspólny runtime (jedno połączenie na proces, reconnect z backoffem,
+        # ponowna subskrypcja po każdym połączeniu)
+        self._mqtt = get_runtime(self.broker_ip, self.broker_port, client_id=client_id or "")
+        self._mqtt.subscribe(self.status_topic, self._on_message)
+        self._mqtt.start_in_thread()
+
+        print(f"[MQTT] Connecting to broker {self.broker_ip}:{self.broker_port}")
+        if not self._mqtt.wait_connected_threadsafe(timeout=connect_timeout):
+            raise RuntimeError(f"Could not connect to MQTT broker within {connect_timeout}s")
+        print("[MQTT] Connected to broker")
+
+    # MQTT callbacks (wywoływane w wątku roboczym runtime'u, nie w pętli sieciowej)
+
+    def _on_message(self, msg: Message):
         try:
             payload = msg.payload.decode("utf-8")
             data = json.loads(payload)
@@ -203,7 +180,7 @@ class TrafficLightEnv(gym.Env):
 
         # Wyślij decyzję na MQTT (Arduino zacznie to respektować w kolejnym etapie)
         payload = json.dumps({"set_active": int(action)})
-        self._client.publish(self.action_topic, payload)
+        self._mqtt.publish_threadsafe(self.action_topic, payload)
 
         # Czekamy na kolejną obserwację
         obs = self._wait_for_obs()
@@ -237,7 +214,6 @@ class TrafficLightEnv(gym.Env):
 
     def close(self):
         try:
-            self._client.loop_stop()
-            self._client.disconnect()
+            self._mqtt.stop_thread()
         except Exception:
             pass
\ No newline at end of file
@@ -0,0 +1,319 @@
+import json
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Tuple
+
+import numpy as np
+
+from mqtt_runtime import Message, get_runtime
+
+
+NUM_LIGHTS = 4
+ZONES = ("left", "right")   # strefy z traffic/cars["zones"] (tryb track detektora)
+
+# jak zapisano pole "b" z traffic/status
+COND_ABSENT = 0     # brak pola
+COND_STRING = 1     # string, zapisany wprost (UTF-8)
+COND_JSON = 2       # inna wartość JSON (np. -1, null), zapisana jako json.dumps
+COND_TOO_LONG = 3   # wartość nie mieściła się w kolumnie - nie zapisana, replay pomija "b"
+COND_WIDTH = 16     # bajtów w kolumnie "cond" (Arduino wysyła 3 znaki albo -1)
+MODE_WIDTH = 8
+
+
+# Schematy kolumn dla nagrywanych topiców.
+# Każdy wiersz ma dodatkowo kolumnę "recv_ms" (czas odbioru przez recorder, int64).
+# Kolumna: (nazwa, dtype, kształt pojedynczej wartości)
+Column = Tuple[str, str, Tuple[int, ...]]
+
+
+def _fixed(value: str, width: int) -> Any:
+    """Tekst jako bajty kolumny o stałej szerokości; None, gdy się nie mieści (bez cichego obcinania)."""
+    raw = value.encode()
+    return raw if len(raw) <= width else None
+
+
+def _float(value: Any, default: float = 0.0) -> float:
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return default
+
+
+def _int(value: Any, default: int = -1) -> int:
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return default
+
+
+def _decode_status(d: Dict[str, Any]) -> Dict[str, Any]:
+    cars = np.zeros(NUM_LIGHTS, dtype=np.int32)
+    state = np.full(NUM_LIGHTS, -1, dtype=np.int8)
+    will_turn = np.zeros(NUM_LIGHTS, dtype=np.int8)
+    duration = np.zeros(NUM_LIGHTS, dtype=np.int32)
+    present = np.zeros(NUM_LIGHTS, dtype=np.int8)   # które światła były w wiadomości
+    for tl in d.get("l", []):
+        idx = _int(tl.get("i"))
+        if 0 <= idx < NUM_LIGHTS:
+            cars[idx] = _int(tl.get("c"))
+            state[idx] = _int(tl.get("s"))
+            will_turn[idx] = _int(tl.get("w"), 0)
+            duration[idx] = _int(tl.get("d"), 0)
+            present[idx] = 1
+
+    if "b" not in d:
+        cond_kind, cond = COND_ABSENT, b""
+    else:
+        is_str = isinstance(d["b"], str)
+        cond_kind = COND_STRING if is_str else COND_JSON
+        cond = _fixed(d["b"] if is_str else json.dumps(d["b"]), COND_WIDTH)
+        if cond is None:
+            print(f"[REC] traffic/status: 'b' longer than {COND_WIDTH} bytes, not recorded: {d['b']!r:.80}")
+            cond_kind, cond = COND_TOO_LONG, b""
+    return {
+        "t": _int(d.get("t")),
+        "cars": cars,
+        "state": state,
+        "will_turn": will_turn,
+        "duration": duration,
+        "present": present,
+        "cond": cond,
+        "cond_kind": cond_kind,
+    }
+
+
+def _encode_status(row: Dict[str, Any]) -> Dict[str, Any]:
+    # tylko światła obecne w nagraniu - brakujące Telegraf zamieniłby na wiersze UNKNOWN
+    lights = [
+        {
+            "i": i,
+            "c": int(row["cars"][i]),
+            "s": int(row["state"][i]),
+            "w": int(row["will_turn"][i]),
+            "d": int(row["duration"][i]),
+        }
+        for i in range(NUM_LIGHTS)
+        if row["present"][i]
+    ]
+    out = {"t": int(row["t"]), "l": lights}
+    cond_kind = int(row["cond_kind"])
+    if cond_kind == COND_STRING:
+        out["b"] = bytes(row["cond"]).decode()
+    elif cond_kind == COND_JSON:
+        out["b"] = json.loads(bytes(row["cond"]).decode())
+    return out
+
+
+def _decode_cars(d: Dict[str, Any]) -> Dict[str, Any]:
+    mode = _fixed(str(d.get("mode", "")), MODE_WIDTH)
+    if mode is None:
+        print(f"[REC] traffic/cars: 'mode' longer than {MODE_WIDTH} bytes, not recorded: {d['mode']!r:.80}")
+        mode = b""
+    zones = d.get("zones")
+    has_zones = isinstance(zones, dict)
+    zone = [zones.get(z) or {} for z in ZONES] if has_zones else [{} for _ in ZONES]
+    return {
+        "timestamp": _int(d.get("timestamp")),
+        "cars": np.array([_int(d.get(str(i))) for i in range(NUM_LIGHTS)], dtype=np.int32),
+        "Ta": _int(d.get("Ta")),
+        "Tstart": _int(d.get("Tstart")),
+        "mode": mode,
+        "has_zones": int(has_zones),
+        "zone_queue": np.array([_int(z.get("queue"), 0) for z in zone], dtype=np.int32),
+        "zone_flow_per_min": np.array([_float(z.get("flow_per_min")) for z in zone], dtype=np.float32),
+        "zone_dwell_s": np.array([_float(z.get("dwell_s")) for z in zone], dtype=np.float32),
+    }
+
+
+def _encode_cars(row: Dict[str, Any]) -> Dict[str, Any]:
+    out = {"timestamp": int(row["timestamp"])}
+    for i in range(NUM_LIGHTS):
+        out[str(i)] = int(row["cars"][i])
+    out["Ta"] = int(row["Ta"]) if row["Ta"] >= 0 else None
+    out["Tstart"] = int(row["Tstart"])
+    mode = bytes(row["mode"]).decode()
+    if mode:
+        out["mode"] = mode
+    if row["has_zones"]:
+        out["zones"] = {
+            z: {
+                "queue": int(row["zone_queue"][k]),
+                "flow_per_min": round(float(row["zone_flow_per_min"][k]), 2),
+                "dwell_s": round(float(row["zone_dwell_s"][k]), 2),
+            }
+            for k, z in enumerate(ZONES)
+        }
+    return out
+
+
+def _decode_action(d: Dict[str, Any]) -> Dict[str, Any]:
+    return {"set_active": _int(d.get("set_active"))}
+
+
+def _encode_action(row: Dict[str, Any]) -> Dict[str, Any]:
+    return {"set_active": int(row["set_active"])}
+
+
+class TopicSchema:
+    def __init__(self,
+                 columns: List[Column],
+                 decode: Callable[[Dict[str, Any]], Dict[str, Any]],
+                 encode: Callable[[Dict[str, Any]], Dict[str, Any]]):
+        self.columns = [("recv_ms", "int64", ())] + columns
+        self.decode = decode
+        self.encode = encode
+
+
+SCHEMAS: Dict[str, TopicSchema] = {
+    "traffic/status": TopicSchema(
+        [
+            ("t", "int64", ()),
+            ("cars", "int32", (NUM_LIGHTS,)),
+            ("state", "int8", (NUM_LIGHTS,)),
+            ("will_turn", "int8", (NUM_LIGHTS,)),
+            ("duration", "int32", (NUM_LIGHTS,)),
+            ("present", "int8", (NUM_LIGHTS,)),
+            ("cond", f"S{COND_WIDTH}", ()),
+            ("cond_kind", "int8", ()),
+        ],
+        _decode_status,
+        _encode_status,
+    ),
+    "traffic/cars": TopicSchema(
+        [
+            ("timestamp", "int64", ()),
+            ("cars", "int32", (NUM_LIGHTS,)),
+            ("Ta", "int64", ()),
+            ("Tstart", "int64", ()),
+            ("mode", f"S{MODE_WIDTH}", ()),
+            ("has_zones", "int8", ()),
+            ("zone_queue", "int32", (len(ZONES),)),
+            ("zone_flow_per_min", "float32", (len(ZONES),)),
+            ("zone_dwell_s", "float32", (len(ZONES),)),
+        ],
+        _decode_cars,
+        _encode_cars,
+    ),
+    "traffic/action": TopicSchema(
+        [("set_active", "int32", ())],
+        _decode_action,
+        _encode_action,
+    ),
+}
+
+
+def topic_dir(root: Path, topic: str) -> Path:
+    return Path(root) / topic.replace("/", "_")
+
+
+class SegmentWriter:
+    """
+    Dopisuje wiersze jednego topicu do kolumnowych segmentów:
+      <root>/<topic>/seg_000000/<kolumna>.npy
+    Każda kolumna to osobny plik .npy o stałym dtype, więc reader może je
+    mapować w pamięci (np.load(mmap_mode="r")) bez kopiowania.
+    Segment jest zapisywany do katalogu tymczasowego i atomowo przemianowywany,
+    więc czytelnik nigdy nie widzi niekompletnego segmentu.
+    """
+
+    def __init__(self, root: Path, topic: str, segment_rows: int = 10000):
+        self.topic = topic
+        self.schema = SCHEMAS[topic]
+        self.dir = topic_dir(root, topic)
+        self.dir.mkdir(parents=True, exist_ok=True)
+        self.segment_rows = segment_rows
+        self._lock = threading.Lock()
+        self._buf: Dict[str, list] = {name: [] for name, _, _ in self.schema.columns}
+        self._rows = 0
+        self._last_flush = time.monotonic()
+        existing = sorted(self.dir.glob("seg_*[0-9]"))
+        self._next_seg = int(existing[-1].name[4:]) + 1 if existing else 0
+
+    def append(self, recv_ms: int, payload: Dict[str, Any]):
+        row = self.schema.decode(payload)
+        row["recv_ms"] = recv_ms
+        with self._lock:
+            for name, _, _ in self.schema.columns:
+                self._buf[name].append(row[name])
+            self._rows += 1
+            if self._rows >= self.segment_rows:
+                self._flush_locked()
+
+    def flush_if_older(self, max_age_s: float):
+        with self._lock:
+            if self._rows and time.monotonic() - self._last_flush >= max_age_s:
+                self._flush_locked()
+
+    def flush(self):
+        with self._lock:
+            if self._rows:
+                self._flush_locked()
+
+    def _flush_locked(self):
+        name = f"seg_{self._next_seg:06d}"
+        tmp = self.dir / (name + ".tmp")
+        tmp.mkdir(exist_ok=True)
+        for col, dtype, shape in self.schema.columns:
+            arr = np.asarray(self._buf[col], dtype=dtype).reshape((self._rows,) + shape)
+            np.save(tmp / f"{col}.npy", arr)
+        os.replace(tmp, self.dir / name)
+        print(f"[REC] {self.topic}: wrote {self._rows} rows to {self.dir / name}")
+
+        self._buf = {col: [] for col, _, _ in self.schema.columns}
+        self._rows = 0
+        self._next_seg += 1
+        self._last_flush = time.monotonic()
+
+
+def main():
+    broker_ip = os.getenv("BROKER_IP", "mosquitto")
+    broker_port = int(os.getenv("BROKER_PORT", "1883"))
+    record_dir = Path(os.getenv("RECORD_DIR", "/app/recordings"))
+    topics = [t for t in os.getenv("RECORD_TOPICS", ",".join(SCHEMAS)).split(",") if t]
+    segment_rows = int(os.getenv("SEGMENT_ROWS", "10000"))
+    flush_interval = float(os.getenv("FLUSH_INTERVAL_S", "60"))
+
+    print("==== MQTT RECORDER ====")
+    print(f"Broker MQTT: {broker_ip}:{broker_port}")
+    print(f"Topics: {topics}")
+    print(f"Output dir: {record_dir} (segment_rows={segment_rows}, flush every {flush_interval}s)")
+
+    writers = {t: SegmentWriter(record_dir, t, segment_rows) for t in topics}
+
+    def on_message(msg: Message):
+        recv_ms = msg.received_ms
+        writer = writers.get(msg.topic)
+        if writer is None:
+            return
+        try:
+            writer.append(recv_ms, json.loads(msg.payload.decode("utf-8")))
+        except Exception as e:
+            print(f"[REC] Skipping malformed message on {msg.topic}: {e}")
+
+    # recorder nie może gubić wiadomości: duża kolejka handlera, a gdy się zapełni -
+    # wstrzymanie odbioru zamiast odrzucania (overflow="block", subskrypcja QoS 1).
+    # Sesja trwała (stały client_id): po zerwaniu połączenia broker trzyma wiadomości QoS 1.
+    # Wiadomości wysłane przez nadawcę z QoS 0 nadal mogą zginąć przy rozłączeniu.
+    rt = get_runtime(broker_ip, broker_port, client_id="traffic_recorder",
+                     handler_queue_size=10000, persistent_session=True)
+    for t in writers:
+        rt.subscribe(t, on_message, overflow="block")
+    rt.start_in_thread()
+
+    try:
+        while True:
+            time.sleep(1.0)
+            for w in writers.values():
+                w.flush_if_older(flush_interval)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        rt.stop_thread()
+        for w in writers.values():
+            w.flush()
+
+
+if __name__ == "__main__":
+    main()
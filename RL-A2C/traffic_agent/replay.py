@@ -0,0 +1,133 @@
+import heapq
+import json
+import os
+import time
+from pathlib import Path
+from typing import Callable, Dict, Iterator, List, Tuple
+
+import numpy as np
+
+from mqtt_runtime import get_runtime
+from .recorder import SCHEMAS, topic_dir
+
+
+MIN_SPEED = 1.0
+MAX_SPEED = 1000.0
+
+
+class SegmentReader:
+    """
+    Czyta segmenty zapisane przez SegmentWriter.
+    Kolumny są mapowane w pamięci (mmap_mode="r") - iteracja po segmentach
+    nie kopiuje danych, a system operacyjny doczytuje tylko potrzebne strony.
+    """
+
+    def __init__(self, root: Path, topic: str):
+        self.topic = topic
+        self.schema = SCHEMAS[topic]
+        self.dir = topic_dir(root, topic)
+
+    def segments(self) -> List[Path]:
+        if not self.dir.is_dir():
+            return []
+        return sorted(p for p in self.dir.glob("seg_*[0-9]") if p.is_dir())
+
+    def iter_segments(self) -> Iterator[Dict[str, np.ndarray]]:
+        for seg in self.segments():
+            yield {
+                col: np.load(seg / f"{col}.npy", mmap_mode="r")
+                for col, _, _ in self.schema.columns
+            }
+
+    def iter_rows(self) -> Iterator[Tuple[int, Dict[str, np.ndarray]]]:
+        """(recv_ms, row) dla każdego wiersza; row to widoki na zmapowane kolumny."""
+        for seg in self.iter_segments():
+            recv = seg["recv_ms"]
+            for i in range(len(recv)):
+                yield int(recv[i]), {col: arr[i] for col, arr in seg.items()}
+
+    def load(self) -> Dict[str, np.ndarray]:
+        """Wszystkie segmenty jako jedna tablica na kolumnę (kopiuje dane)."""
+        segs = list(self.iter_segments())
+        if not segs:
+            return {col: np.empty((0,) + shape, dtype=dtype) for col, dtype, shape in self.schema.columns}
+        return {col: np.concatenate([s[col] for s in segs]) for col, _, _ in self.schema.columns}
+
+
+def iter_merged(root: Path, topics: List[str]) -> Iterator[Tuple[int, str, Dict[str, np.ndarray]]]:
+    """Wiersze wielu topiców połączone w kolejności czasu odbioru (recv_ms)."""
+    def tagged(topic: str):
+        for recv_ms, row in SegmentReader(root, topic).iter_rows():
+            yield recv_ms, topic, row
+
+    return heapq.merge(*(tagged(t) for t in topics), key=lambda item: item[0])
+
+
+def replay(publish: Callable[[str, str], None], root: Path, topics: List[str], speed: float = 1.0) -> int:
+    """
+    Publikuje nagrane wiadomości (publish(topic, payload)) z zachowaniem odstępów
+    czasowych podzielonych przez speed (1x - 1000x). Zwraca liczbę wysłanych wiadomości.
+    """
+    speed = min(max(speed, MIN_SPEED), MAX_SPEED)
+    sent = 0
+    skipped = 0
+    t0_rec = None
+    t0_wall = time.monotonic()
+    for recv_ms, topic, row in iter_merged(root, topics):
+        if t0_rec is None:
+            t0_rec = recv_ms
+        delay = (recv_ms - t0_rec) / 1000.0 / speed - (time.monotonic() - t0_wall)
+        if delay > 0:
+            time.sleep(delay)
+        try:
+            payload = SCHEMAS[topic].encode(row)
+        except (ValueError, KeyError) as e:
+            # jeden uszkodzony wiersz nie przerywa odtwarzania (UnicodeDecodeError i JSONDecodeError to ValueError)
+            skipped += 1
+            print(f"[REPLAY] Skipping row {recv_ms} on {topic}: {e}")
+            continue
+        publish(topic, json.dumps(payload))
+        sent += 1
+    if skipped:
+        print(f"[REPLAY] Skipped {skipped} rows that could not be encoded")
+    return sent
+
+
+def main():
+    broker_ip = os.getenv("BROKER_IP", "mosquitto")
+    broker_port = int(os.getenv("BROKER_PORT", "1883"))
+    record_dir = Path(os.getenv("RECORD_DIR", "/app/recordings"))
+    topics = [t for t in os.getenv("REPLAY_TOPICS", "traffic/status,traffic/cars").split(",") if t]
+    speed = float(os.getenv("REPLAY_SPEED", "1.0"))
+    loop = os.getenv("REPLAY_LOOP", "0") == "1"
+    # domyślnie osobna przestrzeń topiców: recorder i Telegraf słuchają traffic/...,
+    # więc odtworzone wiadomości nie wracają do nagrań ani do traffic_light w InfluxDB
+    prefix = os.getenv("REPLAY_TOPIC_PREFIX", "replay/")
+
+    print("==== MQTT REPLAY ====")
+    print(f"Broker MQTT: {broker_ip}:{broker_port}")
+    print(f"Source dir: {record_dir}")
+    print(f"Topics: {topics} -> prefix '{prefix}', speed: {min(max(speed, MIN_SPEED), MAX_SPEED)}x, loop: {loop}")
+
+    rt = get_runtime(broker_ip, broker_port, client_id="traffic_replay").start_in_thread()
+    rt.wait_connected_threadsafe()
+
+    def publish(topic: str, payload: str):
+        # block=True: przy dużych prędkościach czekamy na miejsce w kolejce zamiast gubić QoS 0
+        rt.publish_threadsafe(prefix + topic, payload, block=True).result()
+
+    try:
+        while True:
+            t0 = time.monotonic()
+            sent = replay(publish, record_dir, topics, speed)
+            print(f"[REPLAY] Sent {sent} messages in {time.monotonic() - t0:.1f}s")
+            if not loop or sent == 0:
+                break
+    except KeyboardInterrupt:
+        pass
+    finally:
+        rt.stop_thread()
+
+
+if __name__ == "__main__":
+    main()
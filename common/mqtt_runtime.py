@@ -0,0 +1,639 @@
+"""
+Shared asyncio MQTT runtime for all services.
+
+One paho client per process, driven by an asyncio event loop (paho's external
+loop API: socket callbacks + loop_read/loop_write/loop_misc), with:
+  - reconnection with exponential backoff and jitter,
+  - automatic resubscription after every (re)connect,
+  - a bounded publish queue drained in batches (QoS 0 is dropped when the queue
+    is full or when it went stale during a disconnect, QoS 1/2 waits for space);
+    publish(wait=True) returns once the packet was written (QoS 0) or acknowledged
+    (QoS 1/2),
+  - handler dispatch off the network loop: every subscription has its own bounded
+    queue and dispatcher task; coroutine handlers are awaited, plain functions run
+    in a thread pool. When a handler falls behind, overflow="drop" drops the oldest
+    queued message and overflow="block" holds new messages back until the handler
+    catches up (see subscribe()).
+
+Works with paho-mqtt 1.x and 2.x. Async services use `await rt.start()`,
+synchronous ones (threads, gym env) use `rt.start_in_thread()` and the
+*_threadsafe methods.
+
+    rt = get_runtime("mosquitto", 1883, client_id="my-service")
+    rt.subscribe("traffic/cars", handle_cars)      # handle_cars(msg: Message)
+    await rt.start()
+    await rt.publish("traffic/action", payload, qos=1)
+"""
+import asyncio
+import collections
+import inspect
+import logging
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+
+import paho.mqtt.client as mqtt
+
+LOG = logging.getLogger("mqtt_runtime")
+
+# received_ms: wall-clock time (ms) when the network loop received the message
+Message = collections.namedtuple("Message", ["topic", "payload", "qos", "retain", "received_ms"])
+
+
+# paho 2.x: PUBACK/PUBCOMP can be withheld until the handler has room (broker-side flow control)
+MANUAL_ACK = hasattr(mqtt, "CallbackAPIVersion")
+
+
+def _make_client(client_id: str, clean_session: bool) -> mqtt.Client:
+    """paho 2.x needs an explicit callback API version, paho 1.x does not know it."""
+    if MANUAL_ACK:
+        return mqtt.Client(mqtt.CallbackAPIVersion.VERSION2, client_id=client_id,
+                           clean_session=clean_session, manual_ack=True)
+    return mqtt.Client(client_id=client_id, clean_session=clean_session)
+
+
+def _rc_value(rc) -> int:
+    # paho 2.x passes ReasonCode objects, paho 1.x plain ints
+    return int(getattr(rc, "value", rc))
+
+
+OVERFLOW_POLICIES = ("drop", "block")
+
+
+class _Subscription:
+    def __init__(self, filters, handler, qos, queue_size, overflow):
+        self.filters = filters
+        self.topic = ", ".join(filters)      # for logs and stats
+        self.handler = handler
+        self.qos = qos
+        self.queue_size = queue_size
+        self.overflow = overflow
+        self.queue = None      # asyncio.Queue, created on the runtime loop
+        self.backlog = collections.deque()   # overflow="block": (Message, _Ack) read while the queue was full
+        self.task = None
+        self.dropped = 0
+
+
+class _Ack:
+    """PUBACK/PUBCOMP of one received message, sent once every block subscription has queued it."""
+
+    def __init__(self, mid, qos, generation, holders):
+        self.mid = mid
+        self.qos = qos
+        self.generation = generation   # connection the message came in on
+        self.holders = holders
+
+
+class MqttRuntime:
+    def __init__(self,
+                 host: str,
+                 port: int = 1883,
+                 client_id: str = "",
+                 keepalive: int = 60,
+                 backoff_min: float = 0.5,
+                 backoff_max: float = 30.0,
+                 publish_queue_size: int = 1000,
+                 publish_batch: int = 100,
+                 qos0_stale_s: float = 5.0,
+                 handler_queue_size: int = 100,
+                 handler_workers: int = 4,
+                 persistent_session: bool = False):
+        """
+        persistent_session: connect with clean_session=False, so the broker keeps the
+        subscriptions and queues QoS 1/2 messages while the client is disconnected.
+        Needs a stable, non-empty client_id. Recommended for overflow="block" subscribers.
+        """
+        if persistent_session and not client_id:
+            raise ValueError("persistent_session needs a stable client_id")
+        self.host = host
+        self.port = int(port)
+        self.client_id = client_id
+        self.keepalive = keepalive
+        self.backoff_min = backoff_min
+        self.backoff_max = backoff_max
+        self.publish_queue_size = publish_queue_size
+        self.publish_batch = publish_batch
+        self.qos0_stale_s = qos0_stale_s
+        self.handler_queue_size = handler_queue_size
+
+        self._client = _make_client(client_id, clean_session=not persistent_session)
+        self._client.on_connect = self._on_connect
+        self._client.on_disconnect = self._on_disconnect
+        self._client.on_message = self._on_message
+        self._client.on_publish = self._on_publish
+        self._client.on_socket_open = self._on_socket_open
+        self._client.on_socket_close = self._on_socket_close
+        self._client.on_socket_register_write = self._on_socket_register_write
+        self._client.on_socket_unregister_write = self._on_socket_unregister_write
+
+        self._executor = ThreadPoolExecutor(max_workers=handler_workers, thread_name_prefix="mqtt-handler")
+        self._subs = {}
+        self._subs_lock = threading.Lock()
+        self._loop = None
+        self._thread = None
+        self._tasks = []
+        self._closing = False
+        self._pub_queue = None
+        self._connected = None
+        self._disconnected = None
+        self._was_connected = False
+        self._fd = None               # socket being read by the loop
+        self._read_paused = False
+        self._service_read = None     # timer handle: reads while paused, so PINGRESP is not missed
+        self._generation = 0          # connection counter; acks from an older connection are not sent
+        self._pending_writes = {}     # mid -> (qos, asyncio.Future) for publish(wait=True)
+        self._stats = {"published": 0, "dropped": 0, "reconnects": 0, "read_pauses": 0}
+
+    # ------------------------------------------------------------------
+    # public API
+    # ------------------------------------------------------------------
+    async def start(self):
+        """Starts the connection supervisor, publisher and dispatchers on the running loop."""
+        if self._closing:
+            raise RuntimeError("MqttRuntime was stopped, use get_runtime() for a new one")
+        self._loop = asyncio.get_running_loop()
+        self._pub_queue = asyncio.Queue(maxsize=self.publish_queue_size)
+        self._connected = asyncio.Event()
+        self._disconnected = asyncio.Event()
+        with self._subs_lock:
+            for sub in self._subs.values():
+                self._start_dispatcher(sub)
+        self._tasks += [
+            self._loop.create_task(self._supervise()),
+            self._loop.create_task(self._publisher()),
+            self._loop.create_task(self._misc()),
+        ]
+        return self
+
+    async def stop(self):
+        """Disconnects and cancels all tasks. A stopped runtime can't be restarted, get_runtime() creates a new one."""
+        self._closing = True
+        _release_runtime(self)
+        if self._service_read is not None:
+            self._service_read.cancel()
+        try:
+            self._client.disconnect()
+        except Exception:
+            pass
+        with self._subs_lock:
+            tasks = self._tasks + [s.task for s in self._subs.values() if s.task]
+        for t in tasks:
+            t.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        for _, done in self._pending_writes.values():
+            if not done.done():
+                done.set_exception(ConnectionError("MQTT runtime stopped"))
+        self._pending_writes.clear()
+        self._executor.shutdown(wait=False)
+
+    def subscribe(self, topic, handler, qos: int = 0, overflow: str = "drop"):
+        """
+        Registers handler(msg: Message) for a topic filter or a list of filters.
+        Safe to call from any thread, before or after start(); the subscription is
+        renewed on every reconnect. Messages of one subscription go through one queue,
+        so a list of filters gets its messages in arrival order across all topics.
+
+        overflow: what happens when the handler's queue is full:
+          - "drop": drop the oldest queued message (dropped QoS 1/2 messages are always logged),
+          - "block": keep the message and hold the rest of the connection back until the
+            handler has room. The subscription uses at least QoS 1: with paho 2.x the
+            PUBACK is withheld until the message is queued, so the broker stops sending
+            once its in-flight window is full while the socket keeps being serviced
+            (pings, acks). QoS 0 messages (publisher used QoS 0) and paho 1.x fall back
+            to pausing socket reads, with a short read every keepalive/4 s.
+            Use with persistent_session=True, so a reconnect does not lose queued messages.
+        Blocking holds back every subscription of the connection.
+        """
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError(f"overflow must be one of {OVERFLOW_POLICIES}, got {overflow!r}")
+        if overflow == "block":
+            qos = max(qos, 1)
+        filters = (topic,) if isinstance(topic, str) else tuple(topic)
+        sub = _Subscription(filters, handler, qos, self.handler_queue_size, overflow)
+        with self._subs_lock:
+            old = self._subs.get(filters)
+            self._subs[filters] = sub
+        if self._loop is not None:
+            self._call_soon(self._activate, sub, old)
+
+    async def publish(self, topic: str, payload, qos: int = 0, retain: bool = False,
+                      block: bool = False, wait: bool = False):
+        """
+        Queues a message. QoS 0 is dropped if the queue is full (unless block=True),
+        QoS 1/2 always waits for space. With wait=True it also waits until the packet
+        was written to the socket (QoS 0) or acknowledged by the broker (QoS 1/2);
+        raises ConnectionError if a QoS 0 message is lost to a disconnect.
+        """
+        if wait:
+            done = self._loop.create_future()
+            await self._pub_queue.put((time.monotonic(), topic, payload, qos, retain, done))
+            await done
+        elif qos == 0 and not block:
+            self.publish_nowait(topic, payload, qos, retain)
+        else:
+            await self._pub_queue.put((time.monotonic(), topic, payload, qos, retain, None))
+
+    def publish_nowait(self, topic: str, payload, qos: int = 0, retain: bool = False) -> bool:
+        """Non-blocking publish from the runtime loop. Returns False when the message was dropped."""
+        try:
+            self._pub_queue.put_nowait((time.monotonic(), topic, payload, qos, retain, None))
+            return True
+        except asyncio.QueueFull:
+            self._stats["dropped"] += 1
+            if qos > 0:
+                LOG.warning("[MQTT] Publish queue full, dropped QoS %d message to %s", qos, topic)
+            return False
+
+    def is_connected(self) -> bool:
+        return self._connected is not None and self._connected.is_set()
+
+    async def wait_connected(self, timeout: float | None = None) -> bool:
+        try:
+            await asyncio.wait_for(self._connected.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    def stats(self) -> dict:
+        out = dict(self._stats)
+        out["publish_queue"] = self._pub_queue.qsize() if self._pub_queue else 0
+        out["read_paused"] = self._read_paused
+        with self._subs_lock:
+            out["dropped_handler"] = {s.topic: s.dropped for s in self._subs.values()}
+        return out
+
+    # ------------------------------------------------------------------
+    # thread facade for synchronous services
+    # ------------------------------------------------------------------
+    def start_in_thread(self, name: str = "mqtt-runtime"):
+        """Runs the runtime on its own event loop in a daemon thread (no-op if already started)."""
+        if self._loop is not None:
+            return self
+        ready = threading.Event()
+        error = []
+
+        def run():
+            loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(loop)
+            try:
+                loop.run_until_complete(self.start())
+            except Exception as e:
+                error.append(e)
+                loop.close()
+                return
+            finally:
+                ready.set()
+            loop.run_forever()
+            loop.close()
+
+        self._thread = threading.Thread(target=run, name=name, daemon=True)
+        self._thread.start()
+        ready.wait()
+        if error:
+            self._thread = None
+            raise error[0]
+        return self
+
+    def stop_thread(self, timeout: float = 5.0):
+        """Stops the runtime and its loop thread; the process can then create a new runtime."""
+        loop, thread = self._loop, self._thread
+        if loop is None or thread is None:
+            _release_runtime(self)
+            return
+        try:
+            asyncio.run_coroutine_threadsafe(self.stop(), loop).result(timeout)
+        except Exception as e:
+            LOG.warning("[MQTT] Clean shutdown failed: %r", e)
+        finally:
+            _release_runtime(self)
+            loop.call_soon_threadsafe(loop.stop)
+            thread.join(timeout)
+            self._loop = None
+            self._thread = None
+
+    def publish_threadsafe(self, topic: str, payload, qos: int = 0, retain: bool = False,
+                           block: bool = False, wait: bool = False):
+        """publish() from another thread; returns a concurrent.futures.Future."""
+        return asyncio.run_coroutine_threadsafe(self.publish(topic, payload, qos, retain, block, wait), self._loop)
+
+    def wait_connected_threadsafe(self, timeout: float | None = None) -> bool:
+        future = asyncio.run_coroutine_threadsafe(self.wait_connected(timeout), self._loop)
+        try:
+            return future.result(timeout)
+        except FutureTimeoutError:
+            future.cancel()
+            return False
+
+    # ------------------------------------------------------------------
+    # connection supervisor
+    # ------------------------------------------------------------------
+    def _backoff(self, attempt: int) -> float:
+        delay = min(self.backoff_max, self.backoff_min * (2 ** attempt))
+        return random.uniform(delay / 2, delay)     # "equal jitter"
+
+    async def _supervise(self):
+        attempt = 0
+        while not self._closing:
+            self._disconnected.clear()
+            try:
+                LOG.info("[MQTT] Connecting to %s:%s", self.host, self.port)
+                # DNS + TCP connect are blocking in paho, keep them off the loop
+                await self._loop.run_in_executor(None, self._client.connect, self.host, self.port, self.keepalive)
+            except Exception as e:
+                delay = self._backoff(attempt)
+                attempt += 1
+                LOG.warning("[MQTT] Connection to %s:%s failed (%s), retrying in %.1fs", self.host, self.port, e, delay)
+                await asyncio.sleep(delay)
+                continue
+
+            await self._disconnected.wait()
+            if self._closing:
+                break
+            if self._was_connected:
+                attempt = 0
+            self._was_connected = False
+            delay = self._backoff(attempt)
+            attempt += 1
+            self._stats["reconnects"] += 1
+            LOG.warning("[MQTT] Disconnected from %s:%s, reconnecting in %.1fs", self.host, self.port, delay)
+            await asyncio.sleep(delay)
+
+    async def _misc(self):
+        # keepalive pings and timeout detection
+        while True:
+            await asyncio.sleep(1.0)
+            self._client.loop_misc()
+
+    # ------------------------------------------------------------------
+    # publisher
+    # ------------------------------------------------------------------
+    async def _publisher(self):
+        while True:
+            batch = [await self._pub_queue.get()]
+            while len(batch) < self.publish_batch and not self._pub_queue.empty():
+                batch.append(self._pub_queue.get_nowait())
+
+            if not self._connected.is_set():
+                await self._connected.wait()
+                # QoS 0 messages that waited for the reconnect are stale by now
+                now = time.monotonic()
+                fresh = [m for m in batch if m[3] > 0 or now - m[0] <= self.qos0_stale_s]
+                for m in batch:
+                    if m[3] == 0 and now - m[0] > self.qos0_stale_s and m[5] is not None:
+                        m[5].set_exception(ConnectionError("QoS 0 message went stale during a disconnect"))
+                self._stats["dropped"] += len(batch) - len(fresh)
+                batch = fresh
+
+            # all packets of the batch are queued before the loop gets to write,
+            # so they go out in as few socket writes as possible
+            for _, topic, payload, qos, retain, done in batch:
+                info = self._client.publish(topic, payload, qos=qos, retain=retain)
+                if done is None or done.done():
+                    continue
+                if info.rc != mqtt.MQTT_ERR_SUCCESS:
+                    done.set_exception(ConnectionError(f"publish to {topic} failed, rc={info.rc}"))
+                elif info.is_published():
+                    done.set_result(None)
+                else:
+                    self._pending_writes[info.mid] = (qos, done)
+            self._stats["published"] += len(batch)
+
+    def _on_publish(self, client, userdata, mid, *args):
+        # QoS 0: packet written to the socket, QoS 1/2: acknowledged by the broker
+        pending = self._pending_writes.pop(mid, None)
+        if pending is not None and not pending[1].done():
+            pending[1].set_result(None)
+
+    # ------------------------------------------------------------------
+    # subscriptions / handler dispatch
+    # ------------------------------------------------------------------
+    def _call_soon(self, fn, *args):
+        if self._loop_thread_is_current():
+            fn(*args)
+        else:
+            self._loop.call_soon_threadsafe(fn, *args)
+
+    def _loop_thread_is_current(self) -> bool:
+        try:
+            return asyncio.get_running_loop() is self._loop
+        except RuntimeError:
+            return False
+
+    def _activate(self, sub, old):
+        if old is not None and old.task is not None:
+            old.task.cancel()
+        self._start_dispatcher(sub)
+        if self.is_connected():
+            self._client.subscribe([(f, sub.qos) for f in sub.filters])
+
+    def _start_dispatcher(self, sub):
+        sub.queue = asyncio.Queue(maxsize=sub.queue_size)
+        sub.task = self._loop.create_task(self._dispatch(sub))
+
+    async def _dispatch(self, sub):
+        is_async = inspect.iscoroutinefunction(sub.handler)
+        while True:
+            msg = await sub.queue.get()
+            if sub.backlog:
+                self._drain_backlog(sub)
+            try:
+                if is_async:
+                    await sub.handler(msg)
+                else:
+                    await self._loop.run_in_executor(self._executor, sub.handler, msg)
+            except Exception:
+                LOG.exception("[MQTT] Handler for %s failed", sub.topic)
+
+    def _drain_backlog(self, sub):
+        while sub.backlog and not sub.queue.full():
+            message, ack = sub.backlog.popleft()
+            sub.queue.put_nowait(message)
+            if ack is not None:
+                ack.holders -= 1
+                if ack.holders == 0:
+                    self._send_ack(ack)
+        if self._read_paused:
+            with self._subs_lock:
+                blocked = any(s.backlog for s in self._subs.values())
+            if not blocked:
+                self._resume_reading()
+
+    def _send_ack(self, ack):
+        # after a reconnect the mid may belong to another message; a persistent
+        # session redelivers the unacknowledged one instead
+        if ack.generation == self._generation:
+            self._client.ack(ack.mid, ack.qos)
+
+    def _pause_reading(self):
+        if not self._read_paused:
+            self._read_paused = True
+            if self._fd is not None:
+                self._fd_op(self._loop.remove_reader, self._fd)
+            self._service_read = self._loop.call_later(self._service_interval(), self._read_while_paused)
+            self._stats["read_pauses"] += 1
+            LOG.debug("[MQTT] Handlers are full, pausing reads from %s:%s", self.host, self.port)
+
+    def _resume_reading(self):
+        if self._read_paused:
+            self._read_paused = False
+            if self._service_read is not None:
+                self._service_read.cancel()
+                self._service_read = None
+            if self._fd is not None:
+                self._fd_op(self._loop.add_reader, self._fd, self._read)
+            LOG.debug("[MQTT] Handlers caught up, resuming reads")
+
+    def _service_interval(self) -> float:
+        return max(self.keepalive / 4.0, 0.5)
+
+    def _read_while_paused(self):
+        # one read per interval keeps PINGRESP and acks flowing; messages read here go to the backlog
+        if not self._read_paused:
+            return
+        if self._fd is not None:
+            self._read()
+        if self._read_paused:
+            self._service_read = self._loop.call_later(self._service_interval(), self._read_while_paused)
+
+    # ------------------------------------------------------------------
+    # paho callbacks (all run on the runtime loop, except socket open/close
+    # which may come from the connect executor thread)
+    # ------------------------------------------------------------------
+    def _on_connect(self, client, userdata, flags, rc, *args):
+        if _rc_value(rc) != 0:
+            LOG.warning("[MQTT] Connection refused by %s:%s, rc=%s", self.host, self.port, rc)
+            return
+        LOG.info("[MQTT] Connected to %s:%s", self.host, self.port)
+        self._was_connected = True
+        self._generation += 1
+        with self._subs_lock:
+            topics = [(f, s.qos) for s in self._subs.values() for f in s.filters]
+        if topics:
+            client.subscribe(topics)
+            LOG.info("[MQTT] Subscribed to %s", ", ".join(t for t, _ in topics))
+        self._loop.call_soon_threadsafe(self._connected.set)
+
+    def _on_disconnect(self, client, userdata, *args):
+        # paho 1.x: (rc,), paho 2.x: (flags, reason_code, properties)
+        rc = args[0] if len(args) == 1 else args[1]
+        LOG.info("[MQTT] Disconnected, rc=%s", rc)
+        self._loop.call_soon_threadsafe(self._connected.clear)
+        self._loop.call_soon_threadsafe(self._disconnected.set)
+        self._loop.call_soon_threadsafe(self._fail_qos0_writes)
+
+    def _fail_qos0_writes(self):
+        # QoS 0 packets not written before a disconnect are lost; QoS 1/2 are resent by paho
+        for mid, (qos, done) in list(self._pending_writes.items()):
+            if qos == 0:
+                del self._pending_writes[mid]
+                if not done.done():
+                    done.set_exception(ConnectionError("disconnected before the message was written"))
+
+    def _on_message(self, client, userdata, msg):
+        message = Message(msg.topic, msg.payload, msg.qos, msg.retain, int(time.time() * 1000))
+        with self._subs_lock:
+            subs = [s for s in self._subs.values()
+                    if any(mqtt.topic_matches_sub(f, msg.topic) for f in s.filters)]
+        held = []
+        for sub in subs:
+            if sub.queue is None:
+                continue    # registered from another thread, dispatcher not started yet
+            if sub.overflow == "block":
+                if sub.backlog or sub.queue.full():
+                    held.append(sub)
+                else:
+                    sub.queue.put_nowait(message)
+                continue
+            if sub.queue.full():
+                # the handler can't keep up: drop the oldest message, keep the newest
+                old = sub.queue.get_nowait()
+                sub.dropped += 1
+                if old.qos > 0:
+                    LOG.warning("[MQTT] Handler for %s is slow, dropped a QoS %d message (%d dropped)",
+                                sub.topic, old.qos, sub.dropped)
+                elif sub.dropped % 100 == 1:
+                    LOG.warning("[MQTT] Handler for %s is slow, dropped %d messages", sub.topic, sub.dropped)
+            sub.queue.put_nowait(message)
+
+        flow_controlled = MANUAL_ACK and msg.qos > 0
+        ack = _Ack(msg.mid, msg.qos, self._generation, len(held)) if flow_controlled else None
+        for sub in held:
+            sub.backlog.append((message, ack))
+        if held and not flow_controlled:
+            # no PUBACK to withhold: stop reading until the dispatchers drain the backlog
+            self._pause_reading()
+        if flow_controlled and not held:
+            self._client.ack(msg.mid, msg.qos)
+
+    # file descriptors are captured here: by the time the loop runs the scheduled
+    # call, paho may already have closed the socket
+    def _on_socket_open(self, client, userdata, sock):
+        self._loop.call_soon_threadsafe(self._socket_opened, sock.fileno())
+
+    def _on_socket_close(self, client, userdata, sock):
+        fd = sock.fileno()
+        self._loop.call_soon_threadsafe(self._socket_closed, fd)
+        self._loop.call_soon_threadsafe(self._fd_op, self._loop.remove_writer, fd)
+
+    def _socket_opened(self, fd):
+        self._fd = fd
+        # a new connection must read its CONNACK even while handlers are blocked
+        self._resume_reading()
+        self._fd_op(self._loop.add_reader, fd, self._read)
+
+    def _socket_closed(self, fd):
+        if self._fd == fd:
+            self._fd = None
+        self._fd_op(self._loop.remove_reader, fd)
+
+    def _on_socket_register_write(self, client, userdata, sock):
+        self._loop.call_soon_threadsafe(self._fd_op, self._loop.add_writer, sock.fileno(), self._write)
+
+    def _on_socket_unregister_write(self, client, userdata, sock):
+        self._loop.call_soon_threadsafe(self._fd_op, self._loop.remove_writer, sock.fileno())
+
+    @staticmethod
+    def _fd_op(op, fd, *args):
+        try:
+            op(fd, *args)
+        except (OSError, ValueError) as e:
+            LOG.debug("[MQTT] Ignoring socket event for closed fd %s: %s", fd, e)
+
+    def _read(self):
+        self._client.loop_read()
+
+    def _write(self):
+        self._client.loop_write()
+
+
+_shared = None
+_shared_args = None
+_shared_lock = threading.Lock()
+
+
+def get_runtime(host: str, port: int = 1883, **kwargs) -> MqttRuntime:
+    """
+    One runtime (one MQTT connection) per process; later calls with the same
+    arguments return the same instance until it is stopped.
+    Raises ValueError when called with different arguments while a runtime is active.
+    """
+    global _shared, _shared_args
+    args = (host, int(port), kwargs)
+    with _shared_lock:
+        if _shared is None:
+            _shared = MqttRuntime(host, port, **kwargs)
+            _shared_args = args
+        elif args != _shared_args:
+            raise ValueError(
+                f"MQTT runtime already created for {_shared_args[0]}:{_shared_args[1]} "
+                f"with {_shared_args[2]}, requested {host}:{port} with {kwargs}")
+        return _shared
+
+
+def _release_runtime(rt: MqttRuntime):
+    global _shared, _shared_args
+    with _shared_lock:
+        if _shared is rt:
+            _shared = None
+            _shared_args = None
@@ -1,36 +1,16 @@
 import os
-import time
+import sys
 import logging
-import socket
-import paho.mqtt.client as mqtt
+from pathlib import Path
 
-LOG = logging.getLogger("traffic_agent")
-logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+# mqtt_runtime.py leży w common/; ten skrypt nie ma własnego obrazu z COPY --from=common,
+# więc dokładamy common/ do ścieżki (kopia obok skryptu, jak w usługach, ma pierwszeństwo)
+sys.path.append(str(Path(__file__).resolve().parent / "common"))
 
+from mqtt_runtime import Message, get_runtime
 
-def make_mqtt_client(*args, **kwargs):
-    """
-    Tworzy klienta mqtt kompatybilnego z paho-mqtt 1.x i 2.x.
-    Preferujemy CallbackAPIVersion.V4 (stare callbacki). Jeśli podanie
-    callback_api_version podniesie wyjątek, fallbackujemy do tworzenia bez parametru.
-    """
-    CallbackAPIVersion = getattr(mqtt, "CallbackAPIVersion", None)
-    if CallbackAPIVersion is not None:
-        api_v4 = getattr(CallbackAPIVersion, "V4", None)
-        if api_v4 is not None:
-            try:
-                return mqtt.Client(*args, callback_api_version=api_v4, **kwargs)
-            except (TypeError, ValueError) as e:
-                LOG.debug("mqtt.Client rejected callback_api_version V4 (%s), falling back: %s", api_v4, e)
-        # fallback: try V5 only if V4 unavailable
-        api_v5 = getattr(CallbackAPIVersion, "V5", None)
-        if api_v5 is not None:
-            try:
-                return mqtt.Client(*args, callback_api_version=api_v5, **kwargs)
-            except (TypeError, ValueError) as e:
-                LOG.debug("mqtt.Client rejected callback_api_version V5 (%s), falling back: %s", api_v5, e)
-    # ostateczny fallback: bez parametru (kompatybilne z paho 1.x)
-    return mqtt.Client(*args, **kwargs)
+LOG = logging.getLogger("traffic_agent")
+logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
 
 
 class TrafficLightEnv:
@@ -44,52 +24,25 @@ class TrafficLightEnv:
         self.port = int(broker_port or os.getenv("BROKER_PORT", "1883"))
         self.client_id = client_id
 
-        self._client = make_mqtt_client(client_id)
+        # wspólny runtime MQTT: reconnect z backoffem i ponowna subskrypcja
+        # (traffic/+/state) po każdym połączeniu
+        self._mqtt = get_runtime(self.broker, self.port, client_id=client_id)
+        self._mqtt.subscribe("traffic/+/state", self._on_message)
+        self._mqtt.start_in_thread()
 
-        self._client.on_connect = self._on_connect
-        self._client.on_message = self._on_message
-        self._client.on_disconnect = self._on_disconnect
+        timeout = connect_retries * retry_delay
+        LOG.info("[MQTT] Connecting to broker %s:%s (timeout %.0fs)", self.broker, self.port, timeout)
+        if not self._mqtt.wait_connected_threadsafe(timeout=timeout):
+            raise RuntimeError(f"Could not connect to MQTT broker {self.broker}:{self.port} within {timeout:.0f}s")
+        LOG.info("[MQTT] Connected to %s:%s", self.broker, self.port)
 
-        self._connect_with_retries(retries=connect_retries, delay=retry_delay)
-        self._client.loop_start()
-
-    def _connect_with_retries(self, retries: int, delay: float):
-        attempt = 0
-        while attempt < retries:
-            attempt += 1
-            try:
-                LOG.info("[MQTT] Connecting to broker %s:%s (attempt %d/%d)", self.broker, self.port, attempt, retries)
-                self._client.connect(self.broker, self.port, keepalive=60)
-                LOG.info("[MQTT] Connected to %s:%s", self.broker, self.port)
-                return
-            except (socket.gaierror, OSError) as e:
-                LOG.warning("[MQTT] Connection failed (attempt %d/%d): %s", attempt, retries, e)
-            except Exception as e:
-                LOG.exception("[MQTT] Unexpected error while connecting (attempt %d/%d): %s", attempt, retries, e)
-            time.sleep(delay)
-        raise RuntimeError(f"Could not connect to MQTT broker {self.broker}:{self.port} after {retries} attempts")
-
-    def _on_connect(self, client, userdata, flags, rc):
-        if rc == 0:
-            LOG.info("[MQTT] on_connect: success, rc=%s", rc)
-            try:
-                client.subscribe("traffic/+/state")
-                LOG.info("[MQTT] Subscribed to traffic/+/state")
-            except Exception:
-                LOG.exception("[MQTT] Failed to subscribe on connect")
-        else:
-            LOG.warning("[MQTT] on_connect: returned code %s", rc)
-
-    def _on_message(self, client, userdata, msg):
+    def _on_message(self, msg: Message):
         LOG.debug("[MQTT] Message received on %s: %s", msg.topic, msg.payload)
 
-    def _on_disconnect(self, client, userdata, rc):
-        LOG.warning("[MQTT] Disconnected (rc=%s).", rc)
-
     def publish(self, topic: str, payload: str, qos: int = 0, retain: bool = False):
         try:
-            result = self._client.publish(topic, payload, qos=qos, retain=retain)
-            LOG.debug("[MQTT] Published to %s: %s (result=%s)", topic, payload, result)
+            result = self._mqtt.publish_threadsafe(topic, payload, qos=qos, retain=retain)
+            LOG.debug("[MQTT] Queued publish to %s: %s", topic, payload)
             return result
         except Exception:
             LOG.exception("[MQTT] Failed to publish to %s", topic)
@@ -112,7 +65,6 @@ class TrafficLightEnv:
 
     def close(self):
         try:
-            self._client.loop_stop()
-            self._client.disconnect()
+            self._mqtt.stop_thread()
         except Exception:
             LOG.exception("Error while closing MQTT client")
\ No newline at end of file
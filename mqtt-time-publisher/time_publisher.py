@@ -1,33 +1,31 @@
-import paho.mqtt.client as mqtt
+import asyncio
+import logging
 import time
 import os
 
-MQTT_BROKER_HOST = os.environ.get('MQTT_HOST', 'mosquitto') 
+from mqtt_runtime import get_runtime
+
+MQTT_BROKER_HOST = os.environ.get('MQTT_HOST', 'mosquitto')
 MQTT_BROKER_PORT = 1883
 TIME_TOPIC = "system/time/unix"
 
-def mqtt_time_publisher():
-    client = mqtt.Client()
-    
-    while True:
-        try:
-            client.connect(MQTT_BROKER_HOST, MQTT_BROKER_PORT, 60)
-            print(f"✅ MQTT Time Publisher connected to {MQTT_BROKER_HOST}:{MQTT_BROKER_PORT}")
-            
-            client.loop_start() 
+async def mqtt_time_publisher():
+    # reconnection with backoff is handled by the shared runtime
+    rt = await get_runtime(MQTT_BROKER_HOST, MQTT_BROKER_PORT, client_id="mqtt-time-publisher").start()
+    await rt.wait_connected()
+    print(f"✅ MQTT Time Publisher connected to {MQTT_BROKER_HOST}:{MQTT_BROKER_PORT}")
 
-            while client.is_connected():
-                current_time_ms = int(time.time() * 1000)
-                
-                client.publish(TIME_TOPIC, str(current_time_ms), qos=1)
-                
-                time.sleep(1) 
+    while True:
+        # publishing only while connected - queued timestamps would be stale after a reconnect
+        if rt.is_connected():
+            current_time_ms = int(time.time() * 1000)
+            await rt.publish(TIME_TOPIC, str(current_time_ms), qos=1)
+        else:
+            print("❌ Not connected to the MQTT broker, waiting for reconnect...")
+            await rt.wait_connected()
 
-            client.loop_stop()
-        
-        except Exception as e:
-            print(f"❌ Connection or publish error: {e}. Retrying connection in 5 seconds...")
-            time.sleep(5)
+        await asyncio.sleep(1)
 
 if __name__ == '__main__':
-    mqtt_time_publisher()
\ No newline at end of file
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    asyncio.run(mqtt_time_publisher())
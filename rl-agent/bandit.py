@@ -1,5 +1,21 @@
 import numpy as np
 
+
+# Zestawy cech kontekstu (qA, qB, peak mogą być skalarami lub wektorami numpy)
+FEATURES = {
+    "full":    lambda qA, qB, peak: [1, qA - qB, np.abs(qA - qB), qA + qB, peak],
+    "no_peak": lambda qA, qB, peak: [1, qA - qB, np.abs(qA - qB), qA + qB],
+    "diff":    lambda qA, qB, peak: [1, qA - qB, np.abs(qA - qB)],
+}
+
+
+def make_context(qA, qB, peak, features="full"):
+    """Wektor kontekstu (d,) dla skalarów lub macierz (N, d) dla wektorów."""
+    qA, qB, peak = (np.asarray(v, dtype=float) for v in (qA, qB, peak))
+    cols = np.broadcast_arrays(*FEATURES[features](qA, qB, peak))
+    return np.stack(cols, axis=-1).astype(float)
+
+
 class Bandit:
     def __init__(self, d=5, actions=[1,2,3,4], lam=1.0, v=0.5):
         self.actions = actions
@@ -22,6 +38,31 @@ class Bandit:
         self.last_action, self.last_context = best, x
         return best
 
+    def action_probs(self, X, n_samples=500, rng=None):
+        """
+        Prawdopodobieństwa wyboru akcji przez Thompson Sampling dla kontekstów X (N, d).
+        Dla każdej akcji x @ theta ~ N(x @ mu, v^2 x^T A^-1 x), więc wystarczy losować
+        skalary zamiast pełnych wektorów theta. Zwraca macierz (N, len(actions)).
+        """
+        rng = np.random.default_rng() if rng is None else rng
+        X = np.atleast_2d(X)
+        Ainv = np.linalg.inv(np.stack([self.A[a] for a in self.actions]))     # (K, d, d)
+        mu = np.einsum("kij,kj->ki", Ainv, np.stack([self.b[a] for a in self.actions]))
+        mean = X @ mu.T                                                         # (N, K)
+        std = self.v * np.sqrt(np.einsum("ni,kij,nj->nk", X, Ainv, X))
+        samples = mean + std * rng.standard_normal((n_samples,) + mean.shape)
+        best = samples.argmax(axis=2)                                           # (S, N)
+        return (best[..., None] == np.arange(len(self.actions))).mean(axis=0)
+
     def update(self, a, x, r):
         self.A[a] += np.outer(x, x)
         self.b[a] += r * x
+
+    def update_batch(self, actions, X, r):
+        """Jak update(), ale dla całej paczki (akcje, konteksty (N, d), nagrody)."""
+        actions, X, r = np.asarray(actions), np.atleast_2d(X), np.asarray(r, dtype=float)
+        for a in self.actions:
+            m = actions == a
+            if m.any():
+                self.A[a] += X[m].T @ X[m]
+                self.b[a] += X[m].T @ r[m]
@@ -1,9 +1,12 @@
 import os
 import json
-import numpy as np
-import paho.mqtt.client as mqtt
+import time
+import asyncio
+import logging
+import threading
 from influxdb_client import InfluxDBClient, Point
-from bandit import Bandit
+from mqtt_runtime import get_runtime
+from bandit import Bandit, make_context
 
 
 # =======================
@@ -39,15 +42,25 @@ write_api = influx.write_api()
 #  Inicjalizacja modelu RL
 # =======================
 bandit = Bandit()
+# on_message działa w puli wątków runtime'u - stan bandyty chroni blokada
+bandit_lock = threading.Lock()
+# identyfikator ostatniej decyzji (jej czas w ns, rosnący) - łączy decision z reward w ope.py
+last_decision_ns = 0
+
+rt = get_runtime(broker, 1883, client_id="rl-agent")
 
 
 # =======================
 #  Funkcje pomocnicze
 # =======================
-def save_to_influx(measurement: str, data: dict):
-    """Zapis danych do InfluxDB (bez przerywania pracy w razie błędu)."""
+def save_to_influx(measurement: str, data: dict, time_ns: int, decision_ns: int):
+    """
+    Zapis danych do InfluxDB (bez przerywania pracy w razie błędu).
+    Punkt ma jawny czas - write_api() wysyła paczkami, więc bez niego serwer
+    nadałby czas dopiero przy flushu.
+    """
     try:
-        point = Point(measurement)
+        point = Point(measurement).time(time_ns).field("decision_ns", int(decision_ns))
         for k, v in data.items():
             point = point.field(k, float(v))
         write_api.write(bucket=influx_bucket, record=point)
@@ -58,7 +71,8 @@ def save_to_influx(measurement: str, data: dict):
 # =======================
 #  Callbacki MQTT
 # =======================
-def on_data(client, userdata, msg):
+def on_data(msg):
+    global last_decision_ns
     try:
         d = json.loads(msg.payload.decode())
         qA = float(d.get("qA", 0))
@@ -66,50 +80,64 @@ def on_data(client, userdata, msg):
         peak = float(d.get("peak", 0))
 
         # wektor kontekstu dla bandyty
-        x = np.array([1, qA - qB, abs(qA - qB), qA + qB, peak], dtype=float)
-        action = bandit.pick_action(x)
+        x = make_context(qA, qB, peak)
+        with bandit_lock:
+            action = bandit.pick_action(x)
+            # prawdopodobieństwo wybranej akcji - potrzebne do ewaluacji offline (ope.py)
+            propensity = bandit.action_probs(x)[0, bandit.actions.index(action)]
+            decision_ns = last_decision_ns = max(time.time_ns(), last_decision_ns + 1)
 
         payload = json.dumps({"preset": int(action)})
-        client.publish(topic_out, payload)
+        rt.publish_threadsafe(topic_out, payload)
         print(f"[MQTT] Sent decision: {payload}")
 
-        save_to_influx("decision", {"qA": qA, "qB": qB, "action": action})
+        save_to_influx("decision", {"qA": qA, "qB": qB, "peak": peak,
+                                    "action": action, "propensity": propensity},
+                       decision_ns, decision_ns)
     except Exception as e:
         print(f"[on_data] Error: {e}")
 
 
-def on_reward(client, userdata, msg):
+def on_reward(msg):
     try:
         d = json.loads(msg.payload.decode())
         reward = float(d.get("reward", 0))
-        a, x = bandit.last_action, bandit.last_context
+        with bandit_lock:
+            a, x = bandit.last_action, bandit.last_context
+            decision_ns = last_decision_ns
+            if a is not None and x is not None:
+                bandit.update(a, x, reward)
         if a is not None and x is not None:
-            bandit.update(a, x, reward)
             print(f"[RL] Updated: action={a}, reward={reward}")
-            save_to_influx("reward", {"action": a, "reward": reward})
+            # decision_ns: decyzja, której model faktycznie przypisał tę nagrodę
+            save_to_influx("reward", {"action": a, "reward": reward}, time.time_ns(), decision_ns)
     except Exception as e:
         print(f"[on_reward] Error: {e}")
 
 
+def on_message(msg):
+    # jedna subskrypcja dla obu topiców: decyzje i nagrody przetwarzane po kolei,
+    # w kolejności nadejścia - nagroda trafia do decyzji, która ją wywołała
+    if msg.topic == topic_in:
+        on_data(msg)
+    elif msg.topic == topic_reward:
+        on_reward(msg)
+
+
 # =======================
 #  Główna pętla
 # =======================
-def main():
+async def main():
     print("[INFO] Starting RL-agent")
     print(f"[INFO] Connecting to MQTT broker '{broker}' ...")
 
-    client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2)
-    client.message_callback_add(topic_in, on_data)
-    client.message_callback_add(topic_reward, on_reward)
-
-    try:
-        client.connect(broker, 1883, 60)
-        client.subscribe([(topic_in, 0), (topic_reward, 0)])
-        print(f"[INFO] Subscribed to: {topic_in}, {topic_reward}")
-        client.loop_forever()
-    except Exception as e:
-        print(f"[ERROR] MQTT connection failed: {e}")
+    # połączenie, ponowne łączenie i ponowna subskrypcja - w runtime
+    rt.subscribe([topic_in, topic_reward], on_message)
+    await rt.start()
+    print(f"[INFO] Handlers registered for: {topic_in}, {topic_reward}")
+    await asyncio.Event().wait()
 
 
 if __name__ == "__main__":
-    main()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    asyncio.run(main())
@@ -0,0 +1,233 @@
+"""
+Offline policy evaluation (OPE) konfiguracji bandyty na zalogowanych decyzjach.
+
+Wczytuje pomiary `decision` (qA, qB, peak, action, propensity) i `reward`
+z InfluxDB 3, łączy je w trójki (kontekst, akcja, nagroda) i dla każdej
+kandydującej konfiguracji (lam, v, features) liczy estymatory IPS, SNIPS
+i doubly-robust. Kandydat jest "odtwarzany" na historii w paczkach: prawdopodobieństwa
+akcji liczone są wektorowo dla całej paczki, po czym model jest aktualizowany
+zalogowanymi nagrodami - tak jak uczyłby się na tych samych danych.
+
+Przykład:
+    python ope.py --lam 0.1,1,10 --v 0.1,0.25,0.5,1 --features full,no_peak --workers 8
+"""
+import argparse
+import itertools
+import json
+import os
+import time
+import urllib.request
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from bandit import Bandit, FEATURES, make_context
+
+
+ACTIONS = [1, 2, 3, 4]
+
+
+# =======================
+#  Wczytanie logów z InfluxDB 3
+# =======================
+def query_sql(sql: str) -> list:
+    """Zapytanie SQL przez HTTP API InfluxDB 3 (/api/v3/query_sql), wynik jako lista słowników."""
+    host = os.getenv("INFLUXDB_HOST", "influxdb3-core")
+    port = os.getenv("INFLUXDB_HTTP_PORT", "8181")
+    token = os.getenv("INFLUXDB_TOKEN", "")
+    bucket = os.getenv("INFLUXDB_BUCKET", "local_system")
+
+    body = json.dumps({"db": bucket, "q": sql, "format": "json"}).encode()
+    req = urllib.request.Request(
+        f"http://{host}:{port}/api/v3/query_sql",
+        data=body,
+        headers={"Authorization": f"Bearer {token}", "Content-Type": "application/json"},
+    )
+    with urllib.request.urlopen(req, timeout=300) as resp:
+        return json.loads(resp.read() or b"[]")
+
+
+def _column(rows: list, name: str) -> np.ndarray:
+    return np.array([np.nan if r.get(name) is None else r[name] for r in rows], dtype=float)
+
+
+def _times_ns(rows: list) -> np.ndarray:
+    return np.array([r["time"] for r in rows], dtype="datetime64[ns]").astype(np.int64)
+
+
+def _ids(rows: list, name: str) -> np.ndarray:
+    """Kolumna int64 (bez przejścia przez float), -1 gdy brak wartości."""
+    return np.array([-1 if r.get(name) is None else int(r[name]) for r in rows], dtype=np.int64)
+
+
+def load_logs(since: str = "30 days") -> dict:
+    """
+    Łączy decyzje z nagrodami po decision_ns - identyfikatorze decyzji, której main.py
+    przypisał nagrodę. Starsze wpisy (bez decision_ns) łączone są po czasie: nagroda
+    należy do ostatniej decyzji przed nią. Bierzemy pierwszą nagrodę po decyzji.
+    """
+    dec = query_sql(f"SELECT * FROM decision WHERE time >= now() - INTERVAL '{since}' ORDER BY time")
+    rew = query_sql(f"SELECT * FROM reward WHERE time >= now() - INTERVAL '{since}' ORDER BY time")
+    if not dec or not rew:
+        raise RuntimeError("No decision/reward rows found in InfluxDB")
+
+    dec_t, rew_t = _times_ns(dec), _times_ns(rew)
+    idx = np.searchsorted(dec_t, rew_t, side="right") - 1
+
+    dec_id, rew_id = _ids(dec, "decision_ns"), _ids(rew, "decision_ns")
+    order = np.argsort(dec_id, kind="stable")
+    pos = np.minimum(np.searchsorted(dec_id[order], rew_id), len(order) - 1)
+    by_id = np.where(dec_id[order][pos] == rew_id, order[pos], -1)
+    idx = np.where(rew_id >= 0, by_id, idx)
+    rew_action, reward = _column(rew, "action"), _column(rew, "reward")
+    dec_action = _column(dec, "action")
+
+    ok = (idx >= 0)
+    ok[ok] &= dec_action[idx[ok]] == rew_action[ok]
+    idx, reward = idx[ok], reward[ok]
+    idx, first = np.unique(idx, return_index=True)
+    reward = reward[first]
+
+    data = {
+        "qA": _column(dec, "qA")[idx],
+        "qB": _column(dec, "qB")[idx],
+        "peak": np.nan_to_num(_column(dec, "peak")[idx]),   # starsze wpisy nie miały peak
+        "action": dec_action[idx].astype(int),
+        "propensity": _column(dec, "propensity")[idx],
+        "reward": reward,
+    }
+
+    # starsze wpisy nie miały propensity - przybliżamy częstością zalogowanej akcji
+    missing = np.isnan(data["propensity"])
+    if missing.any():
+        freq = {a: np.mean(data["action"] == a) for a in ACTIONS}
+        data["propensity"][missing] = [freq[a] for a in data["action"][missing]]
+        print(f"[OPE] {missing.sum()}/{len(missing)} rows without logged propensity, "
+              f"using empirical action frequencies")
+    return data
+
+
+# =======================
+#  Estymatory
+# =======================
+def fit_reward_model(X: np.ndarray, actions: np.ndarray, r: np.ndarray, ridge: float = 1.0) -> np.ndarray:
+    """Ridge regression nagrody per akcja (model bezpośredni dla DR). Zwraca wagi (K, d)."""
+    W = np.zeros((len(ACTIONS), X.shape[1]))
+    for k, a in enumerate(ACTIONS):
+        m = actions == a
+        Xa = X[m]
+        W[k] = np.linalg.solve(Xa.T @ Xa + ridge * np.eye(X.shape[1]), Xa.T @ r[m])
+    return W
+
+
+def cross_fit_reward_model(data: dict, folds: int = 5, seed: int = 0) -> np.ndarray:
+    """
+    Przewidywane nagrody q_hat (N, K) dla DR, wspólne dla wszystkich kandydatów:
+    model na pełnym kontekście ("full"), niezależnie od cech ocenianej konfiguracji,
+    więc różnice DR wynikają z polityki, a nie z siły modelu nagrody.
+    Cross-fitting: wiersze każdego foldu przewiduje model dopasowany na pozostałych.
+    """
+    X = make_context(data["qA"], data["qB"], data["peak"], "full")
+    actions, r = data["action"], data["reward"]
+    n = len(r)
+    fold = np.random.default_rng(seed).permutation(n) % max(min(folds, n), 1)
+    q_hat = np.empty((n, len(ACTIONS)))
+    for k in np.unique(fold):
+        test = fold == k
+        train = ~test if test.sum() < n else test      # jeden fold: brak danych do podziału
+        q_hat[test] = X[test] @ fit_reward_model(X[train], actions[train], r[train]).T
+    return q_hat
+
+
+_DATA = None
+
+
+def _init_worker(data: dict):
+    global _DATA
+    _DATA = data
+
+
+def evaluate(config: dict) -> dict:
+    """Estymaty IPS / SNIPS / DR dla jednej konfiguracji bandyty (q_hat wspólne, z main())."""
+    data = _DATA
+    rng = np.random.default_rng(config.get("seed", 0))
+    X = make_context(data["qA"], data["qB"], data["peak"], config["features"])
+    a_log, r, mu = data["action"], data["reward"], np.clip(data["propensity"], 1e-3, 1.0)
+    a_idx = np.searchsorted(ACTIONS, a_log)
+    q_hat = data["q_hat"]                                             # (N, K)
+
+    bandit = Bandit(d=X.shape[1], actions=ACTIONS, lam=config["lam"], v=config["v"])
+    n, batch = len(r), config["batch"]
+    pi = np.empty(n)
+    dm = np.empty(n)
+    for start in range(0, n, batch):
+        sl = slice(start, start + batch)
+        P = bandit.action_probs(X[sl], n_samples=config["n_samples"], rng=rng)
+        pi[sl] = P[np.arange(P.shape[0]), a_idx[sl]]
+        dm[sl] = (P * q_hat[sl]).sum(axis=1)
+        bandit.update_batch(a_log[sl], X[sl], r[sl])
+
+    w = pi / mu
+    q_log = q_hat[np.arange(n), a_idx]
+    return {
+        **config,
+        "ips": float(np.mean(w * r)),
+        "snips": float(np.sum(w * r) / max(np.sum(w), 1e-12)),
+        "dr": float(np.mean(dm + w * (r - q_log))),
+        "ess": float(np.sum(w) ** 2 / max(np.sum(w ** 2), 1e-12)),   # efektywna liczność próby
+    }
+
+
+# =======================
+#  Główna funkcja
+# =======================
+def _floats(s: str) -> list:
+    return [float(x) for x in s.split(",") if x]
+
+
+def main():
+    p = argparse.ArgumentParser(description="Offline evaluation of bandit configurations on logged decisions")
+    p.add_argument("--lam", default="1.0", help="comma separated lam values")
+    p.add_argument("--v", default="0.5", help="comma separated v values")
+    p.add_argument("--features", default="full", help=f"comma separated feature sets: {', '.join(FEATURES)}")
+    p.add_argument("--since", default="30 days", help="history window, SQL interval (default: 30 days)")
+    p.add_argument("--cache", help="npz file with logs; created from InfluxDB if missing")
+    p.add_argument("--batch", type=int, default=256, help="rows per vectorized replay batch")
+    p.add_argument("--n-samples", type=int, default=500, help="Thompson samples per context for action probabilities")
+    p.add_argument("--workers", type=int, default=os.cpu_count(), help="processes for the config sweep")
+    p.add_argument("--folds", type=int, default=5, help="cross-fitting folds of the DR reward model")
+    p.add_argument("--top", type=int, default=20, help="print the best N configurations (by DR)")
+    args = p.parse_args()
+
+    if args.cache and os.path.exists(args.cache):
+        data = dict(np.load(args.cache))
+        print(f"[OPE] Loaded {len(data['reward'])} rows from {args.cache}")
+    else:
+        data = load_logs(args.since)
+        print(f"[OPE] Loaded {len(data['reward'])} decision/reward rows from InfluxDB")
+        if args.cache:
+            np.savez(args.cache, **data)
+
+    data["q_hat"] = cross_fit_reward_model(data, folds=args.folds)
+
+    configs = [
+        {"lam": lam, "v": v, "features": f, "batch": args.batch, "n_samples": args.n_samples, "seed": i}
+        for i, (lam, v, f) in enumerate(itertools.product(
+            _floats(args.lam), _floats(args.v), [f for f in args.features.split(",") if f]))
+    ]
+    print(f"[OPE] Evaluating {len(configs)} configurations on {args.workers} workers ...")
+
+    t0 = time.time()
+    with ProcessPoolExecutor(max_workers=args.workers, initializer=_init_worker, initargs=(data,)) as pool:
+        results = list(pool.map(evaluate, configs))
+    print(f"[OPE] Done in {time.time() - t0:.1f}s. Logged policy mean reward: {np.mean(data['reward']):.4f}")
+
+    results.sort(key=lambda res: res["dr"], reverse=True)
+    print(f"{'lam':>8} {'v':>6} {'features':>8} {'IPS':>9} {'SNIPS':>9} {'DR':>9} {'ESS':>8}")
+    for res in results[:args.top]:
+        print(f"{res['lam']:>8g} {res['v']:>6g} {res['features']:>8} "
+              f"{res['ips']:>9.4f} {res['snips']:>9.4f} {res['dr']:>9.4f} {res['ess']:>8.1f}")
+
+
+if __name__ == "__main__":
+    main()
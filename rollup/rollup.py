@@ -0,0 +1,236 @@
+"""
+Rollup service: incremental 1-minute and 1-hour aggregates of `traffic_light`.
+
+For every light (tag `id`) and time bucket it writes to `traffic_light_1m` / `traffic_light_1h`:
+  - samples, cars_mean, cars_max
+  - red_ms, green_ms, yellow_ms, red_yellow_ms, unknown_ms (time spent in each state)
+  - red_duration_p50, red_duration_p90, red_duration_p99
+
+Progress is stored as a watermark in the `rollup_watermark` table, so every run
+only reads raw rows from closed buckets that have not been rolled up yet.
+"""
+import json
+import os
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+
+import numpy as np
+
+
+# =======================
+#  Konfiguracja
+# =======================
+INFLUX_HOST = os.getenv("INFLUXDB_HOST", "influxdb3-core")
+INFLUX_PORT = os.getenv("INFLUXDB_HTTP_PORT", "8181")
+INFLUX_TOKEN = os.getenv("INFLUXDB_TOKEN", "")
+INFLUX_BUCKET = os.getenv("INFLUXDB_BUCKET", "local_system")
+INFLUX_URL = f"http://{INFLUX_HOST}:{INFLUX_PORT}"
+
+SOURCE_TABLE = "traffic_light"
+WATERMARK_TABLE = "rollup_watermark"
+RUN_EVERY_S = float(os.getenv("ROLLUP_RUN_EVERY_S", "60"))
+LATENESS_MS = int(float(os.getenv("ROLLUP_LATENESS_S", "10")) * 1000)   # czekamy na spóźnione wiersze
+BACKFILL_MS = int(float(os.getenv("ROLLUP_BACKFILL_DAYS", "7")) * 86400_000)
+MAX_GAP_MS = int(os.getenv("ROLLUP_MAX_GAP_MS", "5000"))   # dłuższa przerwa = brak danych, nie stan
+CHUNK_MS = 6 * 3600_000                                     # maks. zakres surowych danych na zapytanie
+
+# (nazwa, długość kubełka w ms, tabela docelowa)
+ROLLUPS = [
+    ("1m", 60_000, "traffic_light_1m"),
+    ("1h", 3600_000, "traffic_light_1h"),
+]
+
+STATES = ["RED", "GREEN", "YELLOW", "RED_YELLOW"]
+PERCENTILES = [50, 90, 99]
+
+
+# =======================
+#  InfluxDB 3 HTTP API
+# =======================
+def _request(path: str, body: bytes, content_type: str) -> bytes:
+    req = urllib.request.Request(
+        INFLUX_URL + path,
+        data=body,
+        headers={"Authorization": f"Bearer {INFLUX_TOKEN}", "Content-Type": content_type},
+    )
+    with urllib.request.urlopen(req, timeout=120) as resp:
+        return resp.read()
+
+
+def query_sql(sql: str) -> list:
+    body = json.dumps({"db": INFLUX_BUCKET, "q": sql, "format": "json"}).encode()
+    return json.loads(_request("/api/v3/query_sql", body, "application/json") or b"[]")
+
+
+def write_lines(lines: list):
+    if not lines:
+        return
+    params = urllib.parse.urlencode({"bucket": INFLUX_BUCKET, "precision": "ms"})
+    _request(f"/api/v2/write?{params}", "\n".join(lines).encode(), "text/plain; charset=utf-8")
+
+
+def _iso(ms: int) -> str:
+    return str(np.datetime64(int(ms), "ms")) + "Z"
+
+
+def _escape_tag(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace(",", "\\,").replace("=", "\\=").replace(" ", "\\ ")
+
+
+# =======================
+#  Watermark
+# =======================
+def read_watermark(name: str):
+    try:
+        rows = query_sql(
+            f"SELECT max(watermark_ms) AS wm FROM {WATERMARK_TABLE} WHERE rollup = '{name}'"
+        )
+    except urllib.error.HTTPError as e:
+        body = e.read().decode("utf-8", "replace")
+        if WATERMARK_TABLE not in body or "not found" not in body:
+            # 401, 5xx itp. - nie startujemy od nowa całego backfillu, run_rollup ponowi próbę
+            raise
+        # tabela jeszcze nie istnieje (pierwsze uruchomienie)
+        print(f"[ROLLUP] No watermark for {name} ({e.code}), starting from backfill window")
+        return None
+    if not rows or rows[0].get("wm") is None:
+        return None
+    return int(rows[0]["wm"])
+
+
+def write_watermark(name: str, wm_ms: int):
+    write_lines([f"{WATERMARK_TABLE},rollup={name} watermark_ms={wm_ms}i {int(time.time() * 1000)}"])
+
+
+# =======================
+#  Agregacja
+# =======================
+def load_raw(start_ms: int, end_ms: int) -> dict:
+    rows = query_sql(
+        f'SELECT time, id, name, cars, state, red_duration_ms FROM {SOURCE_TABLE} '
+        f"WHERE time >= '{_iso(start_ms)}' AND time < '{_iso(end_ms)}' ORDER BY id, time"
+    )
+    return {
+        "t": np.array([r["time"] for r in rows], dtype="datetime64[ms]").astype(np.int64),
+        "id": np.array([str(r.get("id")) for r in rows]),
+        "name": np.array([str(r.get("name", "")) for r in rows]),
+        "cars": np.array([r.get("cars") or 0 for r in rows], dtype=float),
+        "state": np.array([r.get("state") or "UNKNOWN" for r in rows]),
+        "red_duration_ms": np.array([r.get("red_duration_ms") or 0 for r in rows], dtype=float),
+    }
+
+
+def sample_durations(t: np.ndarray, ids: np.ndarray) -> np.ndarray:
+    """
+    Czas trwania stanu z każdej próbki = odstęp do następnej próbki tego samego światła
+    (stan z t[i] trwa do t[i+1]); odstęp dłuższy niż MAX_GAP_MS to brak danych (0).
+    Ostatnia próbka serii nie ma znanego następnika - 0. load_raw() doczytuje MAX_GAP_MS
+    za końcem zakresu, więc dla próbek z zakresu następnik jest zawsze znany.
+    Wymaga danych posortowanych po (id, time).
+    """
+    dt = np.zeros(len(t), dtype=float)
+    if len(t) > 1:
+        nxt = np.diff(t).astype(float)
+        same = ids[1:] == ids[:-1]
+        dt[:-1] = np.where(same & (nxt <= MAX_GAP_MS), nxt, 0.0)
+    return dt
+
+
+def aggregate(raw: dict, bucket_ms: int, table: str, start_ms: int, end_ms: int) -> list:
+    """
+    Punkty dla kubełków z [start_ms, end_ms). raw może zawierać wiersze do MAX_GAP_MS
+    przed i za zakresem - liczą się tylko do czasu stanów na granicach zakresu.
+    """
+    t = raw["t"]
+    rows = np.nonzero((t >= start_ms) & (t < end_ms))[0]
+    if rows.size == 0:
+        return []
+    dur = sample_durations(t, raw["id"])
+    bucket = t // bucket_ms * bucket_ms
+    id_idx = np.unique(raw["id"], return_inverse=True)[1].astype(np.int64)
+    key = id_idx * 10**12 + bucket // bucket_ms          # (id, kubełek) jako jedna liczba
+    state_idx = np.array([STATES.index(s) if s in STATES else len(STATES) for s in raw["state"]])
+
+    # grupy (id, kubełek) z wierszy zakresu; dane są posortowane po id i czasie
+    groups, inv = np.unique(key[rows], return_inverse=True)
+    order = np.argsort(inv, kind="stable")
+    bounds = np.searchsorted(inv[order], np.arange(len(groups) + 1))
+
+    # czas stanu [t, t + dur) dzielony na granicy kubełka (dur <= MAX_GAP_MS < bucket_ms,
+    # więc nadmiar trafia najwyżej do następnego kubełka)
+    own = np.minimum(t + dur, bucket + bucket_ms) - t
+    spill = t + dur - (bucket + bucket_ms)
+    sp = spill > 0
+    c_key = np.concatenate([key, key[sp] + 1])
+    c_state = np.concatenate([state_idx, state_idx[sp]])
+    c_ms = np.concatenate([own, spill[sp]])
+    pos = np.minimum(np.searchsorted(groups, c_key), len(groups) - 1)
+    hit = groups[pos] == c_key
+    state_ms = np.zeros((len(groups), len(STATES) + 1))
+    np.add.at(state_ms, (pos[hit], c_state[hit]), c_ms[hit])
+
+    lines = []
+    for g in range(len(groups)):
+        idx = rows[order[bounds[g]:bounds[g + 1]]]
+        cars = raw["cars"][idx]
+        state = raw["state"][idx]
+        fields = [
+            f"samples={len(idx)}i",
+            f"cars_mean={cars.mean():.3f}",
+            f"cars_max={int(cars.max())}i",
+        ]
+        for k, st in enumerate(STATES):
+            fields.append(f"{st.lower()}_ms={int(state_ms[g, k])}i")
+        fields.append(f"unknown_ms={int(state_ms[g, len(STATES)])}i")
+        red_mask = state == "RED"
+        if red_mask.any():
+            pct = np.percentile(raw["red_duration_ms"][idx][red_mask], PERCENTILES)
+            fields += [f"red_duration_p{p}={v:.1f}" for p, v in zip(PERCENTILES, pct)]
+
+        first = idx[0]
+        tags = f"id={_escape_tag(raw['id'][first])},name={_escape_tag(raw['name'][first])}"
+        lines.append(f"{table},{tags} {','.join(fields)} {int(bucket[first])}")
+    return lines
+
+
+def run_rollup(name: str, bucket_ms: int, table: str):
+    now_ms = int(time.time() * 1000)
+    end_ms = (now_ms - LATENESS_MS) // bucket_ms * bucket_ms    # tylko zamknięte kubełki
+    wm = read_watermark(name)
+    start_ms = wm if wm is not None else (now_ms - BACKFILL_MS) // bucket_ms * bucket_ms
+    if end_ms <= start_ms:
+        return
+
+    chunk_ms = max(bucket_ms, CHUNK_MS // bucket_ms * bucket_ms)
+    while start_ms < end_ms:
+        stop_ms = min(start_ms + chunk_ms, end_ms)
+        t0 = time.perf_counter()
+        # MAX_GAP_MS przed i za zakresem: stany przechodzące przez granice kawałków
+        raw = load_raw(start_ms - MAX_GAP_MS, stop_ms + MAX_GAP_MS)
+        lines = aggregate(raw, bucket_ms, table, start_ms, stop_ms)
+        write_lines(lines)
+        write_watermark(name, stop_ms)
+        print(f"[ROLLUP] {name}: {_iso(start_ms)} .. {_iso(stop_ms)} "
+              f"{raw['t'].size} rows -> {len(lines)} points ({time.perf_counter() - t0:.2f}s)")
+        start_ms = stop_ms
+
+
+# =======================
+#  Główna pętla
+# =======================
+def main():
+    print(f"[INFO] Rollup service, InfluxDB at {INFLUX_URL}, database '{INFLUX_BUCKET}'")
+    print(f"[INFO] Rollups: {', '.join(f'{n} -> {t}' for n, _, t in ROLLUPS)}, every {RUN_EVERY_S}s")
+    while True:
+        for name, bucket_ms, table in ROLLUPS:
+            try:
+                run_rollup(name, bucket_ms, table)
+            except Exception as e:
+                print(f"[ROLLUP] {name} failed: {e}")
+        time.sleep(RUN_EVERY_S)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,13 @@
 # detect_mqtt.py
-import os, json, time, cv2
+import os, json, time, cv2, queue, threading, logging
+import numpy as np
+import torch
+from concurrent.futures import ThreadPoolExecutor
 from ultralytics import YOLO
-import paho.mqtt.client as mqtt
+from mqtt_runtime import get_runtime
 from datetime import datetime
+from tracker import Tracker, ZoneStats
+from pipeline import StageStats, StatsReporter
 
 # --- configuration---
 MQTT_BROKER = os.getenv("MQTT_BROKER", "mqtt")   # name of the MQTTbroker container
@@ -14,75 +19,257 @@ MODEL_PATH = "yolov8n.pt"
 
 vehicle_classes = {"car", "truck", "bus", "motorbike"}
 
+# --- detect-then-track mode ---
+# DETECT_MODE=detect -> full YOLO detection on every frame (previous behaviour)
+# DETECT_MODE=track  -> full detection every DETECT_EVERY_N frames or on scene change,
+#                       boxes propagated by a CPU tracker in between
+DETECT_MODE = os.getenv("DETECT_MODE", "detect")
+DETECT_EVERY_N = int(os.getenv("DETECT_EVERY_N", 5))
+SCENE_CHANGE_THRESHOLD = float(os.getenv("SCENE_CHANGE_THRESHOLD", 30.0))  # mean abs diff, 0..255
+STATS_WINDOW_S = float(os.getenv("STATS_WINDOW_S", 60.0))
+
+# --- pipeline: decode (thread pool) -> inference -> publish ---
+DECODE_WORKERS = int(os.getenv("DECODE_WORKERS", 4))
+QUEUE_SIZE = int(os.getenv("PIPELINE_QUEUE_SIZE", 8))       # bounded queues = backpressure
+STATS_INTERVAL_S = float(os.getenv("PIPELINE_STATS_INTERVAL_S", 30.0))
+IMG_SIZE = int(os.getenv("IMG_SIZE", 640))                  # model input size (long side)
+MODEL_STRIDE = 32
+if IMG_SIZE % MODEL_STRIDE:
+    # Ultralytics rejects tensor inputs that are not stride-aligned
+    raise ValueError(f"IMG_SIZE must be a multiple of {MODEL_STRIDE}, got {IMG_SIZE}")
+
 # --- YOLO model initialization ---
 model = YOLO(MODEL_PATH)
 model.to('cuda')   # 🔹 added CUDA acceleration
 print("✅ YOLO model loaded on CUDA")
 
-# --- MQTT: callback on message received ---
-def on_message(client, userdata, msg):
-    try:
-        payload = json.loads(msg.payload.decode())
+tracker = Tracker()
+zone_stats = ZoneStats(["left", "right"], window_s=STATS_WINDOW_S)
+frames_since_detect = DETECT_EVERY_N   # first frame always runs full detection
+last_thumb = None                      # thumbnail of the last fully detected frame
+
+
+def make_thumb(frame):
+    """Small grayscale thumbnail used for scene-change detection."""
+    return cv2.resize(cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY), (64, 36), interpolation=cv2.INTER_AREA)
+
+
+def scene_changed(thumb):
+    """Cheap scene-change check: mean abs diff against the last fully detected frame."""
+    if last_thumb is None:
+        return True
+    return float(cv2.absdiff(thumb, last_thumb).mean()) > SCENE_CHANGE_THRESHOLD
+
+
+def preprocess(frame):
+    """
+    CPU part of the Ultralytics preprocessing, done in the decode pool instead of
+    inside model(): letterbox (minimal stride-aligned padding, as LetterBox(auto=True)),
+    BGR -> RGB and a contiguous uint8 CHW array. The GPU upload happens in to_device(),
+    only for frames that actually run detection.
+    Returns (uint8 array 3xHxW, ratio, (pad_x, pad_y)) needed to map boxes back.
+    """
+    h, w = frame.shape[:2]
+    r = min(IMG_SIZE / h, IMG_SIZE / w)
+    new_w, new_h = int(round(w * r)), int(round(h * r))
+    pad_w = (IMG_SIZE - new_w) % MODEL_STRIDE
+    pad_h = (IMG_SIZE - new_h) % MODEL_STRIDE
+    left, top = pad_w // 2, pad_h // 2
+
+    if (new_w, new_h) != (w, h):
+        frame = cv2.resize(frame, (new_w, new_h), interpolation=cv2.INTER_LINEAR)
+    frame = cv2.copyMakeBorder(frame, top, pad_h - top, left, pad_w - left,
+                               cv2.BORDER_CONSTANT, value=(114, 114, 114))
+    chw = np.ascontiguousarray(frame[:, :, ::-1].transpose(2, 0, 1))
+    return chw, r, (left, top)
+
+
+def to_device(chw):
+    """uint8 upload (4x smaller than float32) and normalisation to 0..1 on the GPU; inference thread only."""
+    return torch.from_numpy(chw).to("cuda").unsqueeze(0).float().div_(255.0)
+
+
+def detect_vehicles(inp, shape):
+    """
+    Full YOLO pass on a preprocessed input, returns an (N, 4) list of vehicle boxes
+    (x1, y1, x2, y2) in original frame coordinates.
+    """
+    chw, r, (pad_x, pad_y) = inp
+    results = model(to_device(chw), verbose=False)
+    height, width = shape[:2]
+    boxes = []
+    for box in results[0].boxes:
+        cls = results[0].names[int(box.cls)]
+        if cls in vehicle_classes:
+            # tensor inputs are not rescaled by Ultralytics: undo the letterbox here
+            x1, y1, x2, y2 = (float(v) for v in box.xyxy[0])
+            boxes.append([
+                min(max((x1 - pad_x) / r, 0.0), width),
+                min(max((y1 - pad_y) / r, 0.0), height),
+                min(max((x2 - pad_x) / r, 0.0), width),
+                min(max((y2 - pad_y) / r, 0.0), height),
+            ])
+    return boxes
+
+
+def count_in_areas(boxes, areas):
+    vehicle_counts = {area: 0 for area in areas}
+    for x1, y1, x2, y2 in boxes:
+        cx, cy = int((x1 + x2) / 2), int((y1 + y2) / 2)
+        for area_name, rect in areas.items():
+            (x1a, y1a), (x2a, y2a) = rect
+            if x1a <= cx <= x2a and y1a <= cy <= y2a:
+                vehicle_counts[area_name] += 1
+    return vehicle_counts
+
+
+def track_frame(inp, shape, thumb, areas, now_ms):
+    """
+    Detect-then-track: returns (vehicle_counts, zones, mode).
+    Full detection runs every DETECT_EVERY_N frames or when the scene changes,
+    otherwise the tracker only predicts box positions.
+    """
+    global frames_since_detect, last_thumb
+
+    changed = scene_changed(thumb)
+    tracks = tracker.predict()
+    frames_since_detect += 1
+    if changed or frames_since_detect >= DETECT_EVERY_N:
+        if changed:
+            # new scene: report fresh detections right away instead of waiting for min_hits
+            tracker.restart_warmup()
+        tracks = tracker.update(detect_vehicles(inp, shape), now_ms)
+        frames_since_detect = 0
+        last_thumb = thumb
+        mode = "detect"
+    else:
+        mode = "track"
+
+    zones = zone_stats.update(tracks, areas, now_ms, tracker.live_ids())
+    vehicle_counts = {area: zones[area]["queue"] for area in areas}
+    return vehicle_counts, zones, mode
 
+decode_pool = ThreadPoolExecutor(max_workers=DECODE_WORKERS, thread_name_prefix="decode")
+decode_queue = queue.Queue(maxsize=QUEUE_SIZE)     # futures in arrival order
+publish_queue = queue.Queue(maxsize=QUEUE_SIZE)    # ready traffic/cars payloads
+
+decode_stats = StageStats("decode", workers=DECODE_WORKERS)
+infer_stats = StageStats("infer")
+publish_stats = StageStats("publish")
+
+
+# --- stage 1 (thread pool): JSON parsing, file read, JPEG decode and model preprocessing ---
+def decode_job(raw_payload, Tstart):
+    with decode_stats.busy():
+        payload = json.loads(raw_payload.decode())
         Ta = payload.get("Ta")          # Arduino time
-        Tstart = int(time.time() * 1000)  # MQTT message received time
-        # -----------------------------
 
         filename = payload.get("file")
         if not filename:
-            return
+            return None
         image_path = os.path.join(IMAGES_DIR, filename)
         if not os.path.exists(image_path):
             print(f"⚠ No image found: {image_path}")
-            return
+            return None
 
         frame = cv2.imread(image_path)
-        height, width, _ = frame.shape
-
-        # Two zones (for now, arbitrary)
-        areas = {
-            "left":  [(0, height // 2), (width // 2, height)],
-            "right": [(width // 2, height // 2), (width, height)]
-        }
-
-        # Vehicle detection
-        results = model(frame, verbose=False)
-        vehicle_counts = {area: 0 for area in areas}
-
-        for box in results[0].boxes:
-            cls = results[0].names[int(box.cls)]
-            if cls in vehicle_classes:
-                x1, y1, x2, y2 = box.xyxy[0]
-                cx, cy = int((x1 + x2) / 2), int((y1 + y2) / 2)
-                for area_name, rect in areas.items():
-                    (x1a, y1a), (x2a, y2a) = rect
-                    if x1a <= cx <= x2a and y1a <= cy <= y2a:
-                        vehicle_counts[area_name] += 1
-
-        # Duplication of results: 2 zones → 4 traffic lights
-        out_json = {
-            "timestamp": int(time.time() * 1000),
-            "0": vehicle_counts["left"],    # TLS1_IN
-            "1": vehicle_counts["right"],   # TLS2_OUT
-            "2": vehicle_counts["left"],    # TLS9_IN
-            "3": vehicle_counts["right"],   # TLS10_OUT      
-            "Ta": Ta,
-            "Tstart": Tstart
-        }
-
-        client.publish(MQTT_TOPIC_OUT, json.dumps(out_json))
-        print(f"📤 Published: {out_json}")
-
-    except Exception as e:
-        print(f"❌ Error processing image: {e}")
-
-# --- MQTT client configuration ---
-client = mqtt.Client()
-client.on_message = on_message
-
-client.connect(MQTT_BROKER, MQTT_PORT)
-client.subscribe(MQTT_TOPIC_IN)
-print(f"✅ Subscribed to {MQTT_TOPIC_IN} on {MQTT_BROKER}:{MQTT_PORT}")
-
-# --- main loop ---
-client.loop_forever()
+        if frame is None:
+            print(f"⚠ Could not decode image: {image_path}")
+            return None
+        thumb = make_thumb(frame) if DETECT_MODE == "track" else None
+        return Ta, Tstart, frame.shape, preprocess(frame), thumb
+
+
+# --- stage 2 (single thread, owns the GPU and the tracker): inference + postprocessing ---
+def inference_worker():
+    while True:
+        future = decode_queue.get()
+        try:
+            # futures are consumed in arrival order, so the tracker sees frames in sequence
+            job = future.result()
+            if job is None:
+                continue
+            Ta, Tstart, shape, inp, thumb = job
+
+            with infer_stats.busy():
+                height, width, _ = shape
+
+                # Two zones (for now, arbitrary)
+                areas = {
+                    "left":  [(0, height // 2), (width // 2, height)],
+                    "right": [(width // 2, height // 2), (width, height)]
+                }
+
+                # Vehicle detection
+                if DETECT_MODE == "track":
+                    vehicle_counts, zones, mode = track_frame(inp, shape, thumb, areas, Tstart)
+                else:
+                    vehicle_counts = count_in_areas(detect_vehicles(inp, shape), areas)
+                    zones, mode = None, "detect"
+
+                # Duplication of results: 2 zones → 4 traffic lights
+                out_json = {
+                    "timestamp": int(time.time() * 1000),
+                    "0": vehicle_counts["left"],    # TLS1_IN
+                    "1": vehicle_counts["right"],   # TLS2_OUT
+                    "2": vehicle_counts["left"],    # TLS9_IN
+                    "3": vehicle_counts["right"],   # TLS10_OUT      
+                    "Ta": Ta,
+                    "Tstart": Tstart,
+                    "mode": mode
+                }
+                if zones is not None:
+                    # stable queue lengths + flow (vehicles/min leaving the zone) + mean dwell time
+                    out_json["zones"] = zones
+
+            publish_queue.put(out_json)
+
+        except Exception as e:
+            print(f"❌ Error processing image: {e}")
+        finally:
+            decode_queue.task_done()
+
+
+# --- stage 3 (single thread): MQTT publish ---
+def publish_worker():
+    while True:
+        out_json = publish_queue.get()
+        try:
+            with publish_stats.busy():
+                # QoS 1 so the recorder's persistent session keeps results across its reconnects;
+                # wait=True: returns on PUBACK, so busy time is the real publish cost
+                rt.publish_threadsafe(MQTT_TOPIC_OUT, json.dumps(out_json), qos=1, wait=True).result()
+            print(f"📤 Published: {out_json}")
+        except Exception as e:
+            print(f"❌ Error publishing result: {e}")
+        finally:
+            publish_queue.task_done()
+
+
+# --- MQTT: handler on message received (runs off the network loop) ---
+def on_message(msg):
+    Tstart = msg.received_ms  # MQTT message received time
+    # blocks when the pipeline is full; with overflow="block" the runtime then holds
+    # further frames back (QoS 1, acked once queued) instead of dropping them
+    decode_queue.put(decode_pool.submit(decode_job, msg.payload, Tstart))
+
+# --- MQTT: shared runtime (reconnect with backoff, resubscribe on reconnect) ---
+logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+# persistent session: frames queued by the broker survive a reconnect after a long stall
+rt = get_runtime(MQTT_BROKER, MQTT_PORT, client_id="yolo-detector", persistent_session=True)
+rt.subscribe(MQTT_TOPIC_IN, on_message, overflow="block")
+rt.start_in_thread()
+while not rt.wait_connected_threadsafe(timeout=30):
+    print(f"⏳ Waiting for MQTT broker {MQTT_BROKER}:{MQTT_PORT} ...")
+print(f"✅ Connected to {MQTT_BROKER}:{MQTT_PORT}, subscribed to {MQTT_TOPIC_IN}")
+
+threading.Thread(target=inference_worker, daemon=True, name="infer").start()
+threading.Thread(target=publish_worker, daemon=True, name="publish").start()
+StatsReporter(
+    [decode_stats, infer_stats, publish_stats],
+    {"decode": decode_queue, "publish": publish_queue},
+    interval_s=STATS_INTERVAL_S,
+).start()
+
+# --- main loop: everything runs in the runtime and pipeline threads ---
+threading.Event().wait()
@@ -0,0 +1,69 @@
+# pipeline.py
+# Helpers for the staged decode -> inference -> publish pipeline:
+# per-stage utilisation counters and a periodic reporter thread.
+import threading
+import time
+from contextlib import contextmanager
+
+
+class StageStats:
+    """Busy time and processed items of one pipeline stage (thread-safe)."""
+
+    def __init__(self, name, workers=1):
+        self.name = name
+        self.workers = workers
+        self._lock = threading.Lock()
+        self._busy_s = 0.0
+        self._items = 0
+        self._errors = 0
+
+    @contextmanager
+    def busy(self):
+        t0 = time.perf_counter()
+        try:
+            yield
+        except Exception:
+            with self._lock:
+                self._errors += 1
+            raise
+        finally:
+            dt = time.perf_counter() - t0
+            with self._lock:
+                self._busy_s += dt
+                self._items += 1
+
+    def snapshot(self, elapsed_s):
+        """Returns stats for the last interval and resets the counters."""
+        with self._lock:
+            busy, items, errors = self._busy_s, self._items, self._errors
+            self._busy_s, self._items, self._errors = 0.0, 0, 0
+        return {
+            "util": busy / max(elapsed_s * self.workers, 1e-9),
+            "per_s": items / max(elapsed_s, 1e-9),
+            "avg_ms": 1000.0 * busy / items if items else 0.0,
+            "errors": errors,
+        }
+
+
+class StatsReporter(threading.Thread):
+    """Prints utilisation of every stage and queue depths every interval_s seconds."""
+
+    def __init__(self, stages, queues, interval_s=30.0):
+        super().__init__(daemon=True, name="pipeline-stats")
+        self.stages = stages
+        self.queues = queues
+        self.interval_s = interval_s
+
+    def run(self):
+        last = time.perf_counter()
+        while True:
+            time.sleep(self.interval_s)
+            now = time.perf_counter()
+            elapsed, last = now - last, now
+            parts = []
+            for stage in self.stages:
+                s = stage.snapshot(elapsed)
+                parts.append(f"{stage.name}: util={s['util']:.0%} {s['per_s']:.1f}/s "
+                             f"avg={s['avg_ms']:.1f}ms err={s['errors']}")
+            depths = ", ".join(f"{name}={q.qsize()}/{q.maxsize}" for name, q in self.queues.items())
+            print(f"📊 Pipeline | {' | '.join(parts)} | queues: {depths}")
@@ -0,0 +1,53 @@
+# test_tracker.py
+# Synthetic-box checks for the detect-then-track tracker (numpy only): python -m pytest test_tracker.py
+from tracker import Tracker, ZoneStats
+
+AREAS = {"left": ((0, 0), (400, 200)), "right": ((400, 0), (800, 200))}
+DETECT_EVERY_N = 5
+FRAME_MS = 100
+
+
+def run(frames_of_detections):
+    """Feeds one detection list per detect frame (DETECT_EVERY_N frames apart), returns zone stats per detect."""
+    tracker, zones = Tracker(), ZoneStats(["left", "right"])
+    out, now_ms = [], 0
+    for dets in frames_of_detections:
+        for _ in range(DETECT_EVERY_N - 1):
+            tracker.predict()
+            now_ms += FRAME_MS
+        tracker.predict()
+        now_ms += FRAME_MS
+        tracks = tracker.update(dets, now_ms)
+        out.append(zones.update(tracks, AREAS, now_ms, tracker.live_ids()))
+    return out
+
+
+def test_parked_car_coasts_through_missed_detections():
+    parked = [[20, 50, 80, 90], [120, 50, 180, 90], [220, 50, 280, 90]]
+    hidden = parked[:2]
+    stats = run([parked] * 3 + [hidden] * 2 + [parked] * 2)
+    assert [s["left"]["queue"] for s in stats] == [3] * 7
+    assert all(s["left"]["flow_per_min"] == 0 for s in stats)
+
+
+def test_car_that_left_stops_counting_after_max_coast():
+    parked = [[20, 50, 80, 90], [120, 50, 180, 90]]
+    stats = run([parked] * 3 + [parked[:1]] * 4)
+    assert [s["left"]["queue"] for s in stats] == [2, 2, 2, 2, 2, 1, 1]
+    assert stats[-1]["left"]["flow_per_min"] == 1.0
+
+
+def test_fast_small_box_keeps_its_id():
+    # 20 px wide box moving 30 px per detect interval: no IoU overlap with its zero-velocity prediction
+    frames = [[[10 + 30 * k, 100, 30 + 30 * k, 120]] for k in range(10)]
+    tracker = Tracker()
+    ids = set()
+    for dets in frames:
+        for _ in range(DETECT_EVERY_N):
+            tracker.predict()
+        ids |= {t.id for t in tracker.update(dets)}
+    assert ids == {1}
+
+    stats = run(frames)
+    assert all(s["left"]["queue"] == 1 for s in stats)
+    assert stats[-1]["left"]["flow_per_min"] == 0
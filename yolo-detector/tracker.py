@@ -0,0 +1,255 @@
+# tracker.py
+# Lightweight CPU-only multi-object tracker (IoU association + constant-velocity Kalman)
+# and per-zone queue statistics for detect-then-track mode.
+import time
+
+import numpy as np
+
+
+def iou_matrix(a, b):
+    """IoU between every box in a (N,4) and every box in b (M,4), boxes as x1,y1,x2,y2."""
+    if len(a) == 0 or len(b) == 0:
+        return np.zeros((len(a), len(b)), dtype=float)
+    x1 = np.maximum(a[:, None, 0], b[None, :, 0])
+    y1 = np.maximum(a[:, None, 1], b[None, :, 1])
+    x2 = np.minimum(a[:, None, 2], b[None, :, 2])
+    y2 = np.minimum(a[:, None, 3], b[None, :, 3])
+    inter = np.clip(x2 - x1, 0, None) * np.clip(y2 - y1, 0, None)
+    area_a = (a[:, 2] - a[:, 0]) * (a[:, 3] - a[:, 1])
+    area_b = (b[:, 2] - b[:, 0]) * (b[:, 3] - b[:, 1])
+    union = area_a[:, None] + area_b[None, :] - inter
+    return np.where(union > 0, inter / np.maximum(union, 1e-9), 0.0)
+
+
+class KalmanBox:
+    """
+    A single track: constant-velocity Kalman filter.
+    State: [cx, cy, w, h, vx, vy] (velocity in pixels per frame).
+    """
+
+    _F = np.eye(6)
+    _F[0, 4] = _F[1, 5] = 1.0
+    _H = np.eye(4, 6)
+    _Q = np.diag([1.0, 1.0, 1.0, 1.0, 0.5, 0.5])
+    _R = np.diag([4.0, 4.0, 10.0, 10.0])
+
+    def __init__(self, track_id, box, now_ms):
+        x1, y1, x2, y2 = box
+        self.id = track_id
+        self.x = np.array([(x1 + x2) / 2, (y1 + y2) / 2, x2 - x1, y2 - y1, 0.0, 0.0])
+        self.P = np.diag([10.0, 10.0, 10.0, 10.0, 100.0, 100.0])
+        self.hits = 1
+        self.misses = 0
+        self.frames_since_update = 0  # predict() calls since the last matched detection
+        self.last_seen_ms = now_ms    # time of the last matched detection
+
+    def predict(self):
+        self.frames_since_update += 1
+        self.x = self._F @ self.x
+        self.P = self._F @ self.P @ self._F.T + self._Q
+        # keep the box from collapsing to zero size
+        self.x[2] = max(self.x[2], 1.0)
+        self.x[3] = max(self.x[3], 1.0)
+
+    def update(self, box, now_ms):
+        x1, y1, x2, y2 = box
+        z = np.array([(x1 + x2) / 2, (y1 + y2) / 2, x2 - x1, y2 - y1])
+        y = z - self._H @ self.x
+        S = self._H @ self.P @ self._H.T + self._R
+        K = self.P @ self._H.T @ np.linalg.inv(S)
+        self.x = self.x + K @ y
+        self.P = (np.eye(6) - K @ self._H) @ self.P
+        self.hits += 1
+        self.misses = 0
+        self.frames_since_update = 0
+        self.last_seen_ms = now_ms
+
+    @property
+    def box(self):
+        cx, cy, w, h = self.x[:4]
+        return np.array([cx - w / 2, cy - h / 2, cx + w / 2, cy + h / 2])
+
+    @property
+    def center(self):
+        return float(self.x[0]), float(self.x[1])
+
+
+class Tracker:
+    """
+    SORT-style tracker without a scipy dependency (greedy IoU matching).
+
+    Call predict() on every frame and update(detections) only on frames where
+    full YOLO detection ran. A track is confirmed after min_hits matches; confirmed
+    tracks stay reported while they coast through up to max_coast missed detections
+    (YOLO false negatives), unconfirmed ones only when matched on the latest detection.
+    During warm-up (the first min_hits detections after start or restart_warmup())
+    new detections are reported right away.
+
+    Detections left over after IoU matching are associated by centre distance, with
+    a gate that grows with the frames since the track was last matched - a new track
+    has no velocity yet, so a fast vehicle may no longer overlap its predicted box.
+    """
+
+    def __init__(self, iou_threshold=0.3, max_misses=3, min_hits=2, max_coast=2,
+                 center_gate=0.5, max_center_shift=3.0, max_size_ratio=2.0):
+        self.iou_threshold = iou_threshold
+        self.max_misses = max_misses   # counted in detection frames
+        self.min_hits = min_hits
+        self.max_coast = max_coast     # missed detections a confirmed track stays reported
+        self.center_gate = center_gate         # allowed centre shift per frame, in box sizes
+        self.max_center_shift = max_center_shift   # cap on the whole shift, in box sizes
+        self.max_size_ratio = max_size_ratio   # max area ratio for a centre-distance match
+        self.tracks = []
+        self._next_id = 1
+        self._detections_since_warmup = 0
+
+    def restart_warmup(self):
+        """Report unconfirmed tracks again, e.g. after a scene change."""
+        self._detections_since_warmup = 0
+
+    def predict(self):
+        for t in self.tracks:
+            t.predict()
+        return self.reported()
+
+    def update(self, detections, now_ms=None):
+        now_ms = int(time.time() * 1000) if now_ms is None else now_ms
+        self._detections_since_warmup += 1
+        dets = np.asarray(detections, dtype=float).reshape(-1, 4)
+        boxes = np.array([t.box for t in self.tracks]).reshape(-1, 4)
+        ious = iou_matrix(boxes, dets)
+
+        matched_t, matched_d = set(), set()
+        if ious.size:
+            # greedy: highest IoU pairs first
+            for flat in np.argsort(ious, axis=None)[::-1]:
+                ti, di = np.unravel_index(flat, ious.shape)
+                if ious[ti, di] < self.iou_threshold:
+                    break
+                if ti in matched_t or di in matched_d:
+                    continue
+                self.tracks[ti].update(dets[di], now_ms)
+                matched_t.add(ti)
+                matched_d.add(di)
+
+        for ti, di in self._match_by_center(dets, matched_t, matched_d):
+            self.tracks[ti].update(dets[di], now_ms)
+            matched_t.add(ti)
+            matched_d.add(di)
+
+        for ti, t in enumerate(self.tracks):
+            if ti not in matched_t:
+                t.misses += 1
+        self.tracks = [t for t in self.tracks if t.misses <= self.max_misses]
+
+        for di in range(len(dets)):
+            if di not in matched_d:
+                self.tracks.append(KalmanBox(self._next_id, dets[di], now_ms))
+                self._next_id += 1
+
+        return self.reported()
+
+    def _match_by_center(self, dets, matched_t, matched_d):
+        """Greedy fallback for tracks and detections left unmatched by IoU."""
+        pairs = []
+        for ti, t in enumerate(self.tracks):
+            if ti in matched_t:
+                continue
+            w, h = t.x[2], t.x[3]
+            size = np.sqrt(w * h)
+            gate = min(self.center_gate * max(t.frames_since_update, 1), self.max_center_shift) * size
+            for di in range(len(dets)):
+                if di in matched_d:
+                    continue
+                x1, y1, x2, y2 = dets[di]
+                ratio = (x2 - x1) * (y2 - y1) / max(w * h, 1e-9)
+                if not 1.0 / self.max_size_ratio <= ratio <= self.max_size_ratio:
+                    continue
+                dist = np.hypot((x1 + x2) / 2 - t.x[0], (y1 + y2) / 2 - t.x[1])
+                if dist <= gate:
+                    pairs.append((dist / size, ti, di))
+
+        used_t, used_d = set(), set()
+        for _, ti, di in sorted(pairs):
+            if ti not in used_t and di not in used_d:
+                used_t.add(ti)
+                used_d.add(di)
+                yield ti, di
+
+    def reported(self):
+        warmup = self._detections_since_warmup <= self.min_hits
+        return [
+            t for t in self.tracks
+            if (t.hits >= self.min_hits and t.misses <= self.max_coast)
+            or (t.misses == 0 and warmup)
+        ]
+
+    def live_ids(self):
+        """Ids of all tracks still kept by the tracker, including ones that missed detections."""
+        return {t.id for t in self.tracks}
+
+
+class ZoneStats:
+    """
+    Per-zone statistics from tracks:
+      - queue: number of reported vehicles in the zone,
+      - flow_per_min: vehicles that left the zone within window_s, scaled to one minute,
+      - dwell_s: mean time in the zone (vehicles present now + vehicles that left within the window).
+
+    A vehicle leaves a zone at the time it was last matched there. A track that is
+    alive in the tracker but not reported is kept pending, so a short occlusion
+    does not count as an exit and re-entry.
+    """
+
+    def __init__(self, zone_names, window_s=60.0):
+        self.zone_names = list(zone_names)
+        self.window_ms = int(window_s * 1000)
+        self._exits = {z: [] for z in self.zone_names}   # (exit_ms, dwell_ms)
+        self._entries = {}                                # track_id -> [zone, since_ms, last_seen_ms]
+
+    @staticmethod
+    def zone_of(center, areas):
+        cx, cy = center
+        for name, ((x1, y1), (x2, y2)) in areas.items():
+            if x1 <= cx <= x2 and y1 <= cy <= y2:
+                return name
+        return None
+
+    def update(self, tracks, areas, now_ms, live_ids=None):
+        """tracks: reported tracks; live_ids: ids still alive in the tracker (default: tracks)."""
+        live_ids = {t.id for t in tracks} if live_ids is None else live_ids
+        present = set()
+        for t in tracks:
+            zone = self.zone_of(t.center, areas)
+            entry = self._entries.get(t.id)
+            if entry is not None and entry[0] != zone:
+                self._record_exit(self._entries.pop(t.id))
+                entry = None
+            if zone is None:
+                continue
+            if entry is None:
+                entry = self._entries[t.id] = [zone, t.last_seen_ms, t.last_seen_ms]
+            entry[2] = t.last_seen_ms
+            present.add(t.id)
+
+        # tracks dropped by the tracker have left their zone at their last match
+        for track_id in [i for i in self._entries if i not in live_ids]:
+            self._record_exit(self._entries.pop(track_id))
+
+        horizon = now_ms - self.window_ms
+        stats = {}
+        for z in self.zone_names:
+            self._exits[z] = exits = [e for e in self._exits[z] if e[0] >= horizon]
+            current = [now_ms - self._entries[i][1] for i in present if self._entries[i][0] == z]
+            dwell = current + [d for _, d in exits]
+            stats[z] = {
+                "queue": len(current),
+                "flow_per_min": round(len(exits) * 60000.0 / self.window_ms, 2),
+                "dwell_s": round(sum(dwell) / len(dwell) / 1000.0, 2) if dwell else 0.0,
+            }
+        return stats
+
+    def _record_exit(self, entry):
+        zone, since_ms, last_seen_ms = entry
+        if zone in self._exits:
+            self._exits[zone].append((last_seen_ms, last_seen_ms - since_ms))